@@ -0,0 +1,53 @@
+import time
+
+
+class ActionJournal:
+    # write-ahead record of each mod command's plan steps, keyed by "<comment id>:<step>",
+    # so a command resumed after a crash skips the steps that already happened
+    def __init__(self, local_store, subreddit_name):
+        self.local_store = local_store
+        self.subreddit_name = subreddit_name.lower()
+        local_store.create_table("action_journal (subreddit TEXT, idempotency_key TEXT, status TEXT, result TEXT, "
+                                 "updated_utc REAL, PRIMARY KEY (subreddit, idempotency_key))")
+
+    @staticmethod
+    def get_key(command_id, step):
+        return f"{command_id}:{step}"
+
+    def get_completed(self, command_id):
+        # step -> saved result, for steps that finished
+        rows = self.local_store.query("SELECT idempotency_key, result FROM action_journal WHERE subreddit = ? "
+                                      "AND idempotency_key LIKE ? AND status = 'done'",
+                                      (self.subreddit_name, self.get_key(command_id, "%")))
+        return {key.split(":", 1)[1]: result for key, result in rows}
+
+    def has_entries(self, command_id):
+        return self.local_store.query_one("SELECT 1 FROM action_journal WHERE subreddit = ? "
+                                          "AND idempotency_key LIKE ?",
+                                          (self.subreddit_name, self.get_key(command_id, "%"))) is not None
+
+    def mark_started(self, command_id, step):
+        # a step left started was interrupted, it may or may not have happened, so it is run again
+        self.save(command_id, step, "started", None)
+
+    def mark_done(self, command_id, step, result):
+        # only reddit things are kept, by fullname, e.g. the removal reply that is later distinguished
+        self.save(command_id, step, "done", getattr(result, "fullname", None))
+
+    def record(self, command_id, name, value):
+        # a value the command worked out before acting on it, which a resumed command must reuse
+        self.save(command_id, name, "recorded", value)
+
+    def get_recorded(self, command_id, name):
+        row = self.local_store.query_one("SELECT result FROM action_journal WHERE subreddit = ? "
+                                         "AND idempotency_key = ? AND status = 'recorded'",
+                                         (self.subreddit_name, self.get_key(command_id, name)))
+        return row[0] if row else None
+
+    def save(self, command_id, step, status, result):
+        self.local_store.execute("INSERT OR REPLACE INTO action_journal VALUES (?, ?, ?, ?, ?)",
+                                 (self.subreddit_name, self.get_key(command_id, step), status, result, time.time()))
+
+    def clear(self, command_id):
+        self.local_store.execute("DELETE FROM action_journal WHERE subreddit = ? AND idempotency_key LIKE ?",
+                                 (self.subreddit_name, self.get_key(command_id, "%")))
@@ -0,0 +1,71 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# shared by every plan, each step still waits on the shared reddit rate limiter. Steps make their requests through
+# the handler's reddit instance, which is safe from several threads as set up by RedditClientFactory
+plan_executor_workers = 8
+plan_executor = ThreadPoolExecutor(max_workers=plan_executor_workers, thread_name_prefix="action-plan")
+
+
+class ActionPlan:
+    # the reddit actions for one command, each step starts as soon as the steps it depends on have finished
+    def __init__(self, description, journal=None, command_id=None):
+        self.description = description
+        self.journal = journal
+        self.command_id = command_id
+        self.steps = dict()
+        self.restorers = dict()
+        self.results = dict()
+
+    def add(self, name, callback, depends_on=(), restore=None):
+        # restore rebuilds a journaled step's result, for dependents of a step finished before a restart
+        for dependency in depends_on:
+            if dependency not in self.steps:
+                raise ValueError(f"Step {name} depends on unknown step {dependency} in {self.description}")
+        self.steps[name] = (callback, list(depends_on))
+        if restore:
+            self.restorers[name] = restore
+        return name
+
+    def execute(self, executor=plan_executor):
+        # runs every step, skipping the dependents of any failed step, then raises the first failure
+        pending = dict(self.steps)
+        running = dict()
+        failed = dict()
+        if self.journal:
+            for name, result in self.journal.get_completed(self.command_id).items():
+                if name in pending:
+                    del pending[name]
+                    restore = self.restorers.get(name)
+                    self.results[name] = restore(result) if restore and result else result
+                    print(f"Skipping {name} for {self.description}, already done before a restart")
+        while pending or running:
+            for name, (callback, depends_on) in list(pending.items()):
+                if any(dependency in failed for dependency in depends_on):
+                    failed[name] = None
+                    del pending[name]
+                    print(f"Skipping {name} for {self.description}, a step it depends on failed")
+                elif all(dependency in self.results for dependency in depends_on):
+                    running[executor.submit(self.run_step, name, callback)] = name
+                    del pending[name]
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                except Exception as e:
+                    failed[name] = e
+                    print(f"Step {name} failed for {self.description}: {e}")
+        errors = [error for error in failed.values() if error]
+        if errors:
+            raise errors[0]
+        return self.results
+
+    def run_step(self, name, callback):
+        if not self.journal:
+            return callback()
+        self.journal.mark_started(self.command_id, name)
+        result = callback()
+        self.journal.mark_done(self.command_id, name, result)
+        return result
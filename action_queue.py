@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+import traceback
+
+from metrics import metrics
+from resilient_thread import ResilientThread, stall_clock_paused
+
+
+class ActionQueue:
+    def __init__(self, discord_client, num_workers=2, max_size=100):
+        self.discord_client = discord_client
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=max_size)
+        self.workers = list()
+        self.stats_lock = threading.Lock()
+        self.processed_count = 0
+        self.total_wait_secs = 0
+        self.max_wait_secs = 0
+        self.last_wait_secs = 0
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = ResilientThread(self.discord_client, f"ActionWorker-{i}", target=self.drain)
+            worker.start()
+            self.workers.append(worker)
+        print(f"Started {self.num_workers} action workers, queue size {self.queue.maxsize}")
+
+    def submit(self, description, callback):
+        item = (time.time(), description, callback)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # block ingestion rather than dropping a mod's command, but make the backlog visible
+            message = f"Action queue is full ({self.queue.maxsize}), waiting to enqueue: {description}"
+            self.discord_client.send_error_msg(message)
+            print(message)
+            # the stream is held up by the workers, e.g. whilst reddit's circuit is open, rather than stuck
+            with stall_clock_paused():
+                self.queue.put(item)
+        metrics.set_gauge("usernotebot_queue_depth", self.queue.qsize())
+        print(f"Queued action ({self.queue.qsize()} waiting): {description}")
+
+    def drain(self):
+        while True:
+            enqueue_time, description, callback = self.queue.get()
+            wait_secs = time.time() - enqueue_time
+            self.record_wait(wait_secs)
+            print(f"Executing action after {wait_secs:.1f}s in queue ({self.queue.qsize()} waiting): {description}")
+            try:
+                callback()
+            except Exception as e:
+                message = f"Exception in action worker for {description}: {e}\n```{traceback.format_exc()}```"
+                self.discord_client.send_error_msg(message)
+                print(message)
+            finally:
+                self.queue.task_done()
+
+    def record_wait(self, wait_secs):
+        metrics.observe("usernotebot_queue_wait_seconds", wait_secs)
+        metrics.set_gauge("usernotebot_queue_depth", self.queue.qsize())
+        with self.stats_lock:
+            self.processed_count += 1
+            self.total_wait_secs += wait_secs
+            self.max_wait_secs = max(self.max_wait_secs, wait_secs)
+            self.last_wait_secs = wait_secs
+
+    def get_stats(self):
+        with self.stats_lock:
+            avg_wait_secs = self.total_wait_secs / self.processed_count if self.processed_count else 0
+            return {
+                "depth": self.queue.qsize(),
+                "max_size": self.queue.maxsize,
+                "workers": self.num_workers,
+                "processed": self.processed_count,
+                "last_wait_secs": self.last_wait_secs,
+                "avg_wait_secs": avg_wait_secs,
+                "max_wait_secs": self.max_wait_secs,
+            }
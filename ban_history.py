@@ -0,0 +1,46 @@
+import time
+
+# most recent bans loaded when a subreddit's history is first backfilled, older bans fall back to the user's mod notes
+backfill_ban_limit = 1000
+
+
+class BanHistory:
+    # bans per user, filled from the modlog so incremental bans don't walk the user's mod notes
+    def __init__(self, local_store, subreddit_name):
+        self.local_store = local_store
+        self.subreddit_name = subreddit_name.lower()
+        # a ban seen in both the modlog and the user's mod notes is the same user at the same time
+        local_store.create_table("ban_history (subreddit TEXT, username TEXT, details TEXT, created_utc INTEGER, "
+                                 "PRIMARY KEY (subreddit, username, created_utc))")
+        local_store.create_table("ban_history_backfills (subreddit TEXT PRIMARY KEY, completed_utc REAL)")
+
+    def last_ban_details(self, username):
+        # e.g. "3 days" or "permanent", None if no ban is known
+        row = self.local_store.query_one("SELECT details FROM ban_history WHERE subreddit = ? AND username = ? "
+                                         "ORDER BY created_utc DESC LIMIT 1",
+                                         (self.subreddit_name, str(username).lower()))
+        return row[0] if row else None
+
+    def record_ban(self, username, details, created_utc):
+        if not details:
+            return
+        self.local_store.execute("INSERT OR IGNORE INTO ban_history VALUES (?, ?, ?, ?)",
+                                 (self.subreddit_name, str(username).lower(), details, int(created_utc)))
+
+    def handle_mod_action(self, mod_action):
+        if mod_action.action == "banuser":
+            self.record_ban(mod_action.target_author, mod_action.details, mod_action.created_utc)
+
+    def backfill(self, subreddit, reddit_handler):
+        # the modlog tailer only sees new bans, so existing bans are loaded once per subreddit
+        if self.local_store.query_one("SELECT completed_utc FROM ban_history_backfills WHERE subreddit = ?",
+                                      (self.subreddit_name,)):
+            return
+        print(f"Backfilling ban history for {self.subreddit_name}")
+        mod_actions = reddit_handler.reddit_read(
+            lambda: list(subreddit.mod.log(action="banuser", limit=backfill_ban_limit)), wait=True)
+        for mod_action in mod_actions:
+            self.handle_mod_action(mod_action)
+        self.local_store.execute("INSERT OR REPLACE INTO ban_history_backfills VALUES (?, ?)",
+                                 (self.subreddit_name, time.time()))
+        print(f"Backfilled {len(mod_actions)} bans for {self.subreddit_name}")
@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from discord_client import reddit_executor_workers
+
+
+class FakeDiscordClient:
+    # stands in for DiscordClient, errors are collected instead of being posted to a channel
+    def __init__(self):
+        self.guild_reddit_map = dict()
+        self.action_queue = None
+        self.reddit_executor = ThreadPoolExecutor(max_workers=reddit_executor_workers,
+                                                  thread_name_prefix="reddit-executor")
+        self.errors = list()
+
+    def send_error_msg(self, message):
+        self.errors.append(message)
+
+    async def run_reddit(self, callback):
+        return await asyncio.get_running_loop().run_in_executor(self.reddit_executor, callback)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self.done = True
+
+    async def send_message(self, message, ephemeral=False):
+        self.done = True
+        self.interaction.messages.append(message)
+
+    def is_done(self):
+        return self.done
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, message, ephemeral=False):
+        self.interaction.messages.append(message)
+
+
+class FakeInteraction:
+    # the parts of discord.Interaction the usernote modal touches
+    def __init__(self):
+        self.messages = list()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
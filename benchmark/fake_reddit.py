@@ -0,0 +1,225 @@
+import base64
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+bot_name = "benchbot"
+ratelimit_window_secs = 600
+toolbox_settings = {
+    "ver": 1, "domainTags": [], "modMacros": [], "usernoteColors": [],
+    "banMacros": {"banNote": "", "banMessage": ""},
+    "removalReasons": {"pmsubject": "", "logreason": "", "header": "", "footer": "", "removalOption": "",
+                       "typeReply": "", "typeStickied": False, "typeCommentAsSubreddit": False,
+                       "typeLockComment": False, "typeAsSub": False, "autoArchive": False, "typeLockThread": False,
+                       "logsub": "", "logtitle": "", "bantitle": "", "getfrom": "", "reasons": []},
+}
+rules = [("Be civil", "No personal attacks."), ("No spam", "No self promotion."), ("Stay on topic", "Off topic.")]
+
+
+class FakeRedditState:
+    # just enough of reddit's API for the comment stream, mod commands, toolbox usernotes and discord flows
+    def __init__(self, subreddit_name, moderators, latency_secs=0.05, ratelimit_remaining=600):
+        self.subreddit_name = subreddit_name
+        self.moderators = moderators
+        self.latency_secs = latency_secs
+        self.ratelimit_remaining = ratelimit_remaining
+        self.lock = threading.Lock()
+        self.comments = dict()
+        self.stream_order = list()
+        self.mod_log = list()
+        self.usernotes_users = dict()
+        self.usernotes_mods = [bot_name]
+        self.usernotes_revision = 0
+        self.usernotes_reason = ""
+        self.request_counts = dict()
+        self.window_start_time = time.time()
+        self.window_used = 0
+        self.next_id = int("100000", 36)
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return base36(self.next_id)
+
+    def add_comment(self, author, body, parent_fullname=None, link_id="t3_bench", in_stream=True):
+        comment_id = self.new_id()
+        self.comments[f"t1_{comment_id}"] = {
+            "id": comment_id, "name": f"t1_{comment_id}", "author": author, "body": body,
+            "subreddit": self.subreddit_name, "link_id": link_id, "parent_id": parent_fullname or link_id,
+            "permalink": f"/r/{self.subreddit_name}/comments/bench/_/{comment_id}/",
+            "created_utc": time.time(), "removed": False, "distinguished": None, "stickied": False,
+        }
+        if in_stream:
+            self.stream_order.append(f"t1_{comment_id}")
+        return self.comments[f"t1_{comment_id}"]
+
+    def count(self, key):
+        with self.lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def ratelimit_headers(self):
+        # a 10 minute window like reddit's, so both prawcore and the bot's limiter pace themselves as in production
+        with self.lock:
+            elapsed_secs = time.time() - self.window_start_time
+            if elapsed_secs >= ratelimit_window_secs:
+                self.window_start_time += elapsed_secs - elapsed_secs % ratelimit_window_secs
+                self.window_used = 0
+                elapsed_secs %= ratelimit_window_secs
+            self.window_used += 1
+            return {"x-ratelimit-remaining": str(max(self.ratelimit_remaining - self.window_used, 0)),
+                    "x-ratelimit-used": str(self.window_used),
+                    "x-ratelimit-reset": str(int(ratelimit_window_secs - elapsed_secs))}
+
+    def reset_counts(self):
+        with self.lock:
+            counts = self.request_counts
+            self.request_counts = dict()
+            return counts
+
+    def usernotes_page(self):
+        blob = base64.b64encode(zlib.compress(json.dumps(self.usernotes_users).encode("utf-8"))).decode("utf-8")
+        return json.dumps({"ver": 6, "constants": {"users": self.usernotes_mods, "warnings": [None]}, "blob": blob})
+
+    def save_usernotes(self, content, reason=""):
+        page = json.loads(content)
+        with self.lock:
+            self.usernotes_reason = reason
+            self.usernotes_users = json.loads(zlib.decompress(base64.b64decode(page["blob"])).decode("utf-8"))
+            self.usernotes_mods = page["constants"]["users"]
+            self.usernotes_revision += 1
+
+
+def base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while number:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+    return result or "0"
+
+
+def url_path_name(path):
+    return urlparse(path).path.split("/")[2]
+
+
+def listing(children, after=None):
+    return {"kind": "Listing", "data": {"children": children, "after": after, "before": None}}
+
+
+def comment_thing(comment):
+    return {"kind": "t1", "data": comment}
+
+
+class FakeRedditRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        state = self.server.state
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        path = re.sub(r"/r/[^/]+/", "/r/{sub}/", url.path.rstrip("/"))
+        path = re.sub(r"/user/[^/]+/", "/user/{name}/", path)
+        state.count(f"{method} {path}")
+        time.sleep(state.latency_secs)
+        response = self.route(state, method, path, params, form)
+        # routes return (status, body) for errors
+        status, response = response if isinstance(response, tuple) else (200, response)
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in state.ratelimit_headers().items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, state, method, path, params, form):
+        if path == "/api/v1/access_token":
+            return {"access_token": "bench", "expires_in": 86400, "scope": "*", "token_type": "bearer"}
+        if path == "/api/v1/me":
+            return {"name": bot_name, "id": "benchbot", "created_utc": 0}
+        if path == "/user/{name}/about":
+            name = url_path_name(self.path)
+            return {"kind": "t2", "data": {"name": name, "id": name, "created_utc": 0}}
+        if path == "/r/{sub}/about/moderators":
+            return {"kind": "UserList", "data": {"children": [
+                {"name": name, "id": f"t2_{name}", "date": 0, "mod_permissions": permissions}
+                for name, permissions in state.moderators.items()]}}
+        if path == "/r/{sub}/about/rules":
+            return {"rules": [{"kind": "all", "short_name": short_name, "description": description,
+                               "violation_reason": short_name, "priority": i, "created_utc": 0}
+                              for i, (short_name, description) in enumerate(rules)], "site_rules": []}
+        if path == "/r/{sub}/comments":
+            limit = int(params.get("limit", 100))
+            newest_first = [state.comments[name] for name in reversed(state.stream_order)]
+            if "before" in params:
+                newest_first = newest_first[:state.stream_order[::-1].index(params["before"])] \
+                    if params["before"] in state.stream_order else newest_first
+            return listing([comment_thing(comment) for comment in newest_first[:limit]])
+        if path == "/api/info":
+            return listing([comment_thing(state.comments[name]) for name in params.get("id", "").split(",")
+                            if name in state.comments])
+        if path == "/r/{sub}/about/log":
+            actions = [action for action in reversed(state.mod_log)
+                       if not params.get("type") or action["action"] == params["type"]]
+            return listing([{"kind": "modaction", "data": action} for action in actions[:100]])
+        if path == "/r/{sub}/wiki/toolbox":
+            content = json.dumps(toolbox_settings)
+            return {"kind": "wikipage", "data": {"content_md": content, "revision_by": None, "revision_date": 0,
+                                                 "may_revise": True, "revision_id": "toolbox"}}
+        if path == "/r/{sub}/wiki/usernotes":
+            return {"kind": "wikipage", "data": {"content_md": state.usernotes_page(), "revision_by": None,
+                                                 "revision_date": 0, "may_revise": True,
+                                                 "revision_id": str(state.usernotes_revision)}}
+        if path == "/r/{sub}/wiki/revisions/usernotes":
+            return listing([{"id": str(state.usernotes_revision), "page": "usernotes", "timestamp": 0,
+                             "reason": state.usernotes_reason, "author": None, "revision_hidden": False}])
+        if path == "/r/{sub}/api/wiki/edit":
+            # like reddit, an edit started from an older revision than the page's is rejected
+            if form.get("previous") and form["previous"] != str(state.usernotes_revision):
+                return 409, {"message": "Conflict", "error": 409}
+            state.save_usernotes(form["content"], form.get("reason", ""))
+            return {}
+        if path == "/api/comment":
+            reply = state.add_comment(bot_name, form.get("text", ""), form.get("thing_id"), in_stream=False)
+            return {"json": {"errors": [], "data": {"things": [comment_thing(reply)]}}}
+        if path == "/api/remove":
+            if form.get("id") in state.comments:
+                state.comments[form["id"]]["removed"] = True
+                state.mod_log.append({"id": f"ModAction_{state.new_id()}", "action": "removecomment",
+                                      "mod": bot_name, "target_author": state.comments[form["id"]]["author"],
+                                      "target_fullname": form["id"], "created_utc": time.time(), "details": None,
+                                      "target_permalink": state.comments[form["id"]]["permalink"],
+                                      "target_body": state.comments[form["id"]]["body"], "target_title": None})
+            return {}
+        if path == "/r/{sub}/api/friend":
+            state.mod_log.append({"id": f"ModAction_{state.new_id()}", "action": "banuser", "mod": bot_name,
+                                  "target_author": form.get("name"), "created_utc": time.time(),
+                                  "details": f"{form.get('duration', 'permanent')} days"})
+            return {"json": {"errors": []}}
+        if path == "/api/mod/notes":
+            return {"mod_notes": [], "start_cursor": None, "end_cursor": None, "has_next_page": False}
+        # distinguish, lock, compose and anything else only need to succeed
+        return {"json": {"errors": []}}
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_reddit(state, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeRedditRequestHandler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True, name="FakeReddit").start()
+    return server
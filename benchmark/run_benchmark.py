@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmark.fake_discord import FakeDiscordClient, FakeInteraction
+from benchmark.fake_reddit import FakeRedditState, bot_name, start_fake_reddit
+
+subreddit_name = "benchsub"
+full_mods = ["fullmod0", "fullmod1", "fullmod2"]
+comment_mods = ["commentmod0", "commentmod1"]
+command_templates = [".r 1", ".r 1,2 b3 please stay civil", ".r 2 bi", ".r 3 bp spam account",
+                     ".n 1 borderline", ".u watch this user", ".r 1,3 repeated incivility"]
+chatter = ["I disagree", "source?", "great post", "this is the way", "lol"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a comment stream against a local fake reddit and report "
+                                                 "command throughput, action latency and reddit calls per command")
+    parser.add_argument("--commands", type=int, default=30, help="synthetic mod commands to generate")
+    parser.add_argument("--chatter-per-command", type=int, default=3, help="non-mod comments per mod command")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="replay a recorded stream (jsonl) instead of generating one")
+    parser.add_argument("--record", help="save the stream that was run (jsonl), for replaying later")
+    parser.add_argument("--modal-flows", type=int, default=5, help="discord usernote modal submissions to run")
+    parser.add_argument("--arrival-rate", type=float, default=20, help="stream comments posted per second")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake reddit response time")
+    parser.add_argument("--ratelimit-remaining", type=int, default=600,
+                        help="reddit requests allowed per 10 minute window")
+    parser.add_argument("--workers", type=int, default=2, help="action queue workers")
+    parser.add_argument("--timeout", type=float, default=1800, help="give up waiting for commands after this")
+    parser.add_argument("--output", help="write the results as json, e.g. to compare against a baseline")
+    parser.add_argument("--baseline", help="results json from an earlier run to compare against")
+    return parser.parse_args()
+
+
+def generate_stream(args):
+    # each line is a comment, parent is the index of an earlier line
+    rng = random.Random(args.seed)
+    stream = list()
+    for i in range(args.commands):
+        for _ in range(args.chatter_per_command):
+            stream.append({"author": f"user{rng.randrange(50)}", "body": rng.choice(chatter), "parent": None})
+        stream.append({"author": f"user{rng.randrange(50)}", "body": rng.choice(chatter), "parent": None})
+        mod = rng.choice(full_mods) if rng.random() < 0.8 else rng.choice(comment_mods)
+        stream.append({"author": mod, "body": rng.choice(command_templates), "parent": len(stream) - 1})
+    return stream
+
+
+def load_stream(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_stream(path, stream):
+    with open(path, "w") as f:
+        for line in stream:
+            f.write(json.dumps(line) + "\n")
+
+
+def is_command(line, command_types):
+    return line["author"] in full_mods + comment_mods and line["body"].split(" ")[0] in command_types
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples):
+    return {"count": len(samples), "p50_secs": percentile(samples, 0.5), "p99_secs": percentile(samples, 0.99)}
+
+
+def record_observations(metrics, action_samples):
+    # keep every raw action latency, histogram buckets are too coarse to compare runs
+    observe = metrics.observe
+
+    def recording_observe(name, value, **labels):
+        if name in ["usernotebot_action_seconds", "usernotebot_discord_command_seconds"]:
+            action = labels.get("action") or labels.get("command")
+            action_samples.setdefault(action, list()).append(value)
+        observe(name, value, **labels)
+    metrics.observe = recording_observe
+
+
+def feed_stream(state, stream, arrival_rate):
+    comments = list()
+    for line in stream:
+        parent = comments[line["parent"]]["name"] if line["parent"] is not None else None
+        comments.append(state.add_comment(line["author"], line["body"], parent))
+        time.sleep(1 / arrival_rate)
+
+
+def run_modal_flows(discord_client, reddit_handler, state, count, modal_samples):
+    from discord_client import UsernoteModal
+
+    async def submit_all():
+        for i in range(count):
+            target = state.add_comment(f"user{i}", "reported on discord")
+            modal = UsernoteModal(reddit_handler, full_mods[0], target["permalink"], target["author"],
+                                  True, True, target["name"])
+            modal.rule._value = "1,2"
+            modal.should_comment._value = "yes"
+            modal.ban_type._value = "i" if i % 2 else "no"
+            start_time = time.time()
+            await modal.on_submit(FakeInteraction())
+            modal_samples.append(time.time() - start_time)
+
+    asyncio.run(submit_all())
+
+
+def main():
+    args = parse_args()
+    stream = load_stream(args.replay) if args.replay else generate_stream(args)
+    if args.record:
+        save_stream(args.record, stream)
+
+    state = FakeRedditState(subreddit_name,
+                            {**{mod: ["all"] for mod in full_mods + [bot_name]},
+                             **{mod: ["posts"] for mod in comment_mods}},
+                            latency_secs=args.latency_ms / 1000, ratelimit_remaining=args.ratelimit_remaining)
+    server = start_fake_reddit(state)
+    store_dir = tempfile.mkdtemp(prefix="usernotebot-benchmark")
+    # praw only takes its urls from praw.ini, the user level one lets bot.create_reddit run unchanged
+    fake_url = f"http://127.0.0.1:{server.server_port}"
+    with open(os.path.join(store_dir, "praw.ini"), "w") as f:
+        f.write(f"[DEFAULT]\noauth_url={fake_url}\nreddit_url={fake_url}\n")
+    os.environ["XDG_CONFIG_HOME"] = store_dir
+
+    import bot
+    from action_queue import ActionQueue
+    from local_store import LocalStore
+    from metrics import metrics
+
+    class RecordingActionQueue(ActionQueue):
+        # exact per-command latency, from being queued to every reddit call and usernote write finishing
+        def __init__(self, discord_client, num_workers, max_size):
+            super().__init__(discord_client, num_workers, max_size)
+            self.command_samples = list()
+            self.completed = 0
+            self.completed_lock = threading.Lock()
+
+        def submit(self, description, callback):
+            submit_time = time.time()
+
+            def timed_callback():
+                try:
+                    callback()
+                finally:
+                    with self.completed_lock:
+                        self.command_samples.append(time.time() - submit_time)
+                        self.completed += 1
+            super().submit(description, timed_callback)
+
+    action_samples = dict()
+    record_observations(metrics, action_samples)
+
+    discord_client = FakeDiscordClient()
+    local_store = LocalStore(os.path.join(store_dir, "benchmark.db"))
+    action_queue = RecordingActionQueue(discord_client, args.workers, 100)
+    action_queue.start()
+    discord_client.action_queue = action_queue
+
+    setup_start_time = time.time()
+    subreddit_tracker, reddit_handler = bot.create_subreddit_handler("password", bot_name, "id", "secret",
+                                                                     discord_client, local_store, action_queue,
+                                                                     subreddit_name)
+    discord_client.guild_reddit_map["benchguild"] = reddit_handler
+    setup_secs = time.time() - setup_start_time
+    setup_counts = state.reset_counts()
+    action_samples.clear()
+
+    expected_commands = sum(1 for line in stream if is_command(line, bot.command_types))
+    print(f"Replaying {len(stream)} comments with {expected_commands} mod commands")
+    threading.Thread(target=bot.handle_comment_stream, daemon=True, name="Benchmark-Usernotes",
+                     args=(discord_client, action_queue, subreddit_tracker, reddit_handler)).start()
+
+    run_start_time = time.time()
+    feed_stream(state, stream, args.arrival_rate)
+    while action_queue.completed < expected_commands and time.time() - run_start_time < args.timeout:
+        time.sleep(0.1)
+    commands_secs = time.time() - run_start_time
+    stream_counts = state.reset_counts()
+
+    modal_samples = list()
+    modal_start_time = time.time()
+    run_modal_flows(discord_client, reddit_handler, state, args.modal_flows, modal_samples)
+    # the modal doesn't wait on its usernotes, let the write buffer drain before counting calls
+    while reddit_handler.usernote_writer.pending:
+        time.sleep(0.1)
+    time.sleep(reddit_handler.usernote_writer.window_secs + 1)
+    modal_secs = time.time() - modal_start_time
+    modal_counts = state.reset_counts()
+
+    stream_calls = sum(stream_counts.values())
+    modal_calls = sum(modal_counts.values())
+    results = {
+        "comments": len(stream),
+        "commands": expected_commands,
+        "completed_commands": action_queue.completed,
+        "setup_secs": setup_secs,
+        "setup_calls": sum(setup_counts.values()),
+        "commands_per_min": action_queue.completed / commands_secs * 60 if commands_secs else 0,
+        "command_latency": summarize(action_queue.command_samples),
+        "calls_per_command": stream_calls / action_queue.completed if action_queue.completed else 0,
+        "modal_flows": args.modal_flows,
+        "modal_latency": summarize(modal_samples),
+        "calls_per_modal_flow": modal_calls / args.modal_flows if args.modal_flows else 0,
+        "modal_secs": modal_secs,
+        "action_latency": {action: summarize(samples) for action, samples in sorted(action_samples.items())},
+        "stream_calls_by_endpoint": dict(sorted(stream_counts.items())),
+        "modal_calls_by_endpoint": dict(sorted(modal_counts.items())),
+        "errors": len(discord_client.errors),
+        "error_messages": sorted(set(error.splitlines()[0] for error in discord_client.errors)),
+    }
+    print_results(results, load_results(args.baseline) if args.baseline else None)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    # the bot's modlog thread isn't a daemon, don't wait on it
+    os._exit(0 if action_queue.completed == expected_commands else 1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_results(results, baseline):
+    def compare(value, baseline_value):
+        if baseline_value is None:
+            return ""
+        change = (value - baseline_value) / baseline_value * 100 if baseline_value else 0
+        return f" (baseline {baseline_value:.2f}, {change:+.0f}%)"
+
+    def line(label, key, sub_key=None):
+        value = results[key][sub_key] if sub_key else results[key]
+        baseline_value = None
+        if baseline and key in baseline:
+            baseline_value = baseline[key][sub_key] if sub_key else baseline[key]
+        print(f"{label}: {value:.2f}{compare(value, baseline_value)}")
+
+    print()
+    print(f"Commands completed: {results['completed_commands']}/{results['commands']}, "
+          f"errors reported: {results['errors']}")
+    print(f"Setup: {results['setup_secs']:.2f}s, {results['setup_calls']} reddit calls")
+    line("Commands per minute", "commands_per_min")
+    line("Command latency p50 (s)", "command_latency", "p50_secs")
+    line("Command latency p99 (s)", "command_latency", "p99_secs")
+    line("Reddit calls per command", "calls_per_command")
+    line("Modal flow latency p50 (s)", "modal_latency", "p50_secs")
+    line("Modal flow latency p99 (s)", "modal_latency", "p99_secs")
+    line("Reddit calls per modal flow", "calls_per_modal_flow")
+    print("Action latency:")
+    for action, summary in results["action_latency"].items():
+        print(f"\t{action}: n={summary['count']} p50={summary['p50_secs']:.3f}s p99={summary['p99_secs']:.3f}s")
+    for error in results["error_messages"]:
+        print(f"Error: {error}")
+    print("Stream reddit calls by endpoint:")
+    for endpoint, count in results["stream_calls_by_endpoint"].items():
+        print(f"\t{endpoint}: {count}")
+
+
+if __name__ == "__main__":
+    main()
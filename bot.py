@@ -1,4 +1,6 @@
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from threading import Thread
 import os
 
@@ -6,20 +8,34 @@ from praw.reddit import Submission
 
 import config
 import time
-import praw
 
-from discord_client import DiscordClient
+from action_plan import ActionPlan
+from action_queue import ActionQueue
+from circuit_breaker import circuit_breakers
+from local_store import LocalStore
+from metrics import metrics, start_metrics_server
+from moderator_directory import ModeratorDirectory
+from modlog_tailer import ModlogTailer
+from rate_limiter import reddit_rate_limiter
 from reddit_actions_handler import RedditActionsHandler
+from reddit_factory import reddit_client_factory
 from settings import SettingsFactory
 from subreddit_tracker import SubredditTracker
+from supervisor import RemoteRedditHandler, SubredditWorker, share_rate_limit
 from resilient_thread import ResilientThread
+from stream_watchdog import stream_watchdog, watched_stream
+from subreddit_manager import SubredditManager, read_subreddits_file
 from usernote_utils import find_rules, find_ban, find_message
 
 max_retries = 5
 retry_wait_time_secs = 30
+# subreddits bootstrapped at once, each opens its reddit instances and makes its startup reads
+max_bootstrap_workers = 8
+command_types = [".r", ".n", ".u"]
 
 
 def run_forever():
+    startup_time = time.time()
     # get config from env vars if set, otherwise from config file
     client_id = os.environ.get("CLIENT_ID", config.CLIENT_ID)
     client_secret = os.environ.get("CLIENT_SECRET", config.CLIENT_SECRET)
@@ -30,74 +46,336 @@ def run_forever():
     discord_error_channel_name = os.environ.get("DISCORD_ERROR_CHANNEL", config.DISCORD_ERROR_CHANNEL)
     subreddits_config = os.environ.get("SUBREDDITS", config.SUBREDDITS)
     subreddit_names = [subreddit.strip() for subreddit in subreddits_config.split(",")]
+    subreddits_path = os.environ.get("SUBREDDITS_PATH", config.SUBREDDITS_PATH)
+    multiplex_streams = is_enabled(os.environ.get("MULTIPLEX_STREAMS", config.MULTIPLEX_STREAMS))
+    supervisor_mode = is_enabled(os.environ.get("SUPERVISOR_MODE", config.SUPERVISOR_MODE))
+    action_workers = int(os.environ.get("ACTION_WORKERS", config.ACTION_WORKERS))
+    action_queue_size = int(os.environ.get("ACTION_QUEUE_SIZE", config.ACTION_QUEUE_SIZE))
+    local_store_path = os.environ.get("LOCAL_STORE_PATH", config.LOCAL_STORE_PATH)
+    metrics_port = os.environ.get("METRICS_PORT", config.METRICS_PORT)
+    metrics_host = os.environ.get("METRICS_HOST", config.METRICS_HOST)
+    reddit_pool_size = int(os.environ.get("REDDIT_POOL_SIZE", config.REDDIT_POOL_SIZE))
+    if subreddits_path:
+        # subreddits and their settings, watched for changes whilst running
+        subreddits = read_subreddits_file(subreddits_path, subreddit_names)
+        for subreddit_name, overrides in subreddits.items():
+            SettingsFactory.set_overrides(subreddit_name, overrides)
+        subreddit_names = list(subreddits)
+    print("CONFIG: subreddits_path=" + str(subreddits_path))
     print("CONFIG: subreddit_names=" + str(subreddit_names))
+    print("CONFIG: multiplex_streams=" + str(multiplex_streams))
+    print("CONFIG: supervisor_mode=" + str(supervisor_mode))
+    print(f"CONFIG: action_workers={action_workers}, action_queue_size={action_queue_size}")
+    print("CONFIG: local_store_path=" + str(local_store_path))
+    print(f"CONFIG: metrics_host={metrics_host}, metrics_port={metrics_port}")
+    print("CONFIG: reddit_pool_size=" + str(reddit_pool_size))
+    reddit_client_factory.configure(reddit_pool_size)
 
-    # discord stuff
+    if metrics_port:
+        start_metrics_server(int(metrics_port), metrics_host)
+
+    # discord logs in while subreddits are bootstrapped, it's only waited on to map guilds to subreddits
+    # deferred so supervised worker processes, which import this module, don't load discord
+    from discord_client import DiscordClient
     discord_client = DiscordClient(discord_error_guild_name, discord_error_channel_name)
     discord_client.add_commands()
     Thread(target=discord_client.run, args=(discord_token,)).start()
-    while not discord_client.is_ready:
-        time.sleep(1)
+    startup_phases = dict()
+
+    if supervisor_mode:
+        # each subreddit's streams and actions run in a worker process, discord stays in this one
+        workers = start_supervised_workers(bot_password, bot_username, client_id, client_secret, discord_client,
+                                           local_store_path, action_workers, action_queue_size, reddit_pool_size,
+                                           subreddit_names)
+        subreddit_manager = SubredditManager(discord_client, (bot_password, bot_username, client_id, client_secret),
+                                             subreddits_path, worker_args=(local_store_path, action_workers,
+                                                                           action_queue_size, reddit_pool_size))
+        discord_client.subreddit_manager = subreddit_manager
+        wait_for_discord(discord_client, startup_time, startup_phases)
+        for worker in workers:
+            reddit_handler = RemoteRedditHandler(discord_client, worker)
+            add_usernote_guild(discord_client, worker.subreddit_name, reddit_handler)
+            subreddit_manager.adopt(worker.subreddit_name, reddit_handler, worker)
+        if subreddits_path:
+            subreddit_manager.start_watching()
+        report_startup(startup_time, startup_phases)
+        while True:
+            time.sleep(5)
+
+    with timed_phase(startup_phases, "local_store"):
+        local_store = LocalStore(local_store_path)
+
+    # stream threads only filter and enqueue mod commands, workers execute them
+    action_queue = ActionQueue(discord_client, action_workers, action_queue_size)
+    action_queue.start()
+    discord_client.action_queue = action_queue
 
+    stream_routes = dict()
+    subreddit_manager = SubredditManager(discord_client, (bot_password, bot_username, client_id, client_secret),
+                                         subreddits_path, local_store, action_queue, stream_routes)
+    discord_client.subreddit_manager = subreddit_manager
     try:
-        for subreddit_name in subreddit_names:
-            reddit_handler = create_usernotes_thread(bot_password, bot_username, client_id, client_secret,
-                                                     discord_client, subreddit_name)
-            settings = SettingsFactory.get_settings(subreddit_name)
-            if settings.guild_name:
-                discord_client.add_usernote_guild(settings.guild_name, reddit_handler)
+        reddit_handlers = dict()
+        bootstrap_start_time = time.time()
+        # subreddits are independent, so one slow or failing subreddit doesn't hold up the others
+        # at least one worker, the subreddits file may start empty
+        bootstrap_workers = max(min(len(subreddit_names), max_bootstrap_workers), 1)
+        with ThreadPoolExecutor(max_workers=bootstrap_workers, thread_name_prefix="Bootstrap") as executor:
+            futures = {subreddit_name: executor.submit(bootstrap_subreddit, bot_password, bot_username,
+                                                       client_id, client_secret, discord_client, local_store,
+                                                       action_queue, multiplex_streams, subreddit_name)
+                       for subreddit_name in subreddit_names}
+            for subreddit_name, future in futures.items():
+                try:
+                    subreddit_tracker, reddit_handler, bootstrap_secs = future.result()
+                except Exception as e:
+                    message = f"Exception starting {subreddit_name}: {e}\n```{traceback.format_exc()}```"
+                    discord_client.send_error_msg(message)
+                    print(message)
+                    continue
+                startup_phases[f"subreddit {subreddit_name}"] = bootstrap_secs
+                stream_routes[subreddit_name.lower()] = (subreddit_tracker, reddit_handler)
+                reddit_handlers[subreddit_name] = reddit_handler
+        startup_phases["subreddits"] = time.time() - bootstrap_start_time
+        if multiplex_streams and stream_routes:
+            create_multiplexed_thread(bot_password, bot_username, client_id, client_secret,
+                                      discord_client, action_queue, stream_routes)
+        wait_for_discord(discord_client, startup_time, startup_phases)
+        for subreddit_name, reddit_handler in reddit_handlers.items():
+            add_usernote_guild(discord_client, subreddit_name, reddit_handler)
+            subreddit_manager.adopt(subreddit_name, reddit_handler)
+        if subreddits_path:
+            subreddit_manager.start_watching()
     except Exception as e:
         message = f"Exception in main processing: {e}\n```{traceback.format_exc()}```"
         discord_client.send_error_msg(message)
         print(message)
+    report_startup(startup_time, startup_phases)
 
     # this is required as otherwise discord fails when main thread is done
     while True:
         time.sleep(5)
 
 
-def create_usernotes_thread(bot_password, bot_username, client_id, client_secret,
-                            discord_client, subreddit_name):
-    print(f"Creating {subreddit_name} subreddit thread")
+def start_supervised_workers(bot_password, bot_username, client_id, client_secret, discord_client,
+                             local_store_path, action_workers, action_queue_size, reddit_pool_size,
+                             subreddit_names):
+    credentials = (bot_password, bot_username, client_id, client_secret)
+    workers = [SubredditWorker(discord_client, subreddit_name, credentials, local_store_path,
+                               action_workers, action_queue_size, reddit_pool_size)
+               for subreddit_name in subreddit_names]
+    discord_client.subreddit_workers.extend(workers)
+    share_rate_limit(discord_client.subreddit_workers)
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def bootstrap_subreddit(bot_password, bot_username, client_id, client_secret, discord_client, local_store,
+                        action_queue, multiplex_streams, subreddit_name):
+    start_time = time.time()
+    if multiplex_streams:
+        subreddit_tracker, reddit_handler = create_subreddit_handler(bot_password, bot_username,
+                                                                     client_id, client_secret,
+                                                                     discord_client, local_store,
+                                                                     action_queue, subreddit_name)
+    else:
+        subreddit_tracker, reddit_handler = create_usernotes_thread(bot_password, bot_username,
+                                                                    client_id, client_secret,
+                                                                    discord_client, local_store,
+                                                                    action_queue, subreddit_name)
+    return subreddit_tracker, reddit_handler, time.time() - start_time
+
+
+def wait_for_discord(discord_client, startup_time, startup_phases):
+    discord_client.ready_event.wait()
+    startup_phases["discord_login"] = discord_client.ready_time - startup_time
+
+
+def add_usernote_guild(discord_client, subreddit_name, reddit_handler):
+    settings = SettingsFactory.get_settings(subreddit_name)
+    if settings.guild_name:
+        discord_client.add_usernote_guild(settings.guild_name, reddit_handler)
+
+
+@contextmanager
+def timed_phase(startup_phases, phase):
+    start_time = time.time()
+    yield
+    startup_phases[phase] = time.time() - start_time
+
 
-    # each thread needs its own read for thread safety
-    reddit = praw.Reddit(
-        client_id=client_id, client_secret=client_secret,
-        user_agent=f"flyio:com.usernotebot.{subreddit_name}",
-        redirect_uri="http://localhost:8080",  # unused for script applications
-        username=bot_username, password=bot_password,
-        check_for_async=False
-    )
+def report_startup(startup_time, startup_phases):
+    startup_phases["total"] = time.time() - startup_time
+    for phase, seconds in startup_phases.items():
+        metrics.set_gauge("usernotebot_startup_seconds", seconds, phase=phase)
+    phase_lines = [f"\t{phase}: {seconds:.1f}s" for phase, seconds in startup_phases.items()]
+    print("Startup timing:\n" + "\n".join(phase_lines))
+
+
+def is_enabled(config_value):
+    return str(config_value).strip().lower() in ["true", "1", "yes", "y"]
+
+
+def create_reddit(bot_password, bot_username, client_id, client_secret, user_agent_suffix):
+    return reddit_client_factory.create(bot_password, bot_username, client_id, client_secret, user_agent_suffix)
+
+
+def create_subreddit_handler(bot_password, bot_username, client_id, client_secret,
+                             discord_client, local_store, action_queue, subreddit_name):
+    # each stream thread has its own instance, action plan steps share the handler's (see RedditClientFactory)
+    reddit = create_reddit(bot_password, bot_username, client_id, client_secret, subreddit_name)
+    subreddit = reddit.subreddit(subreddit_name)
+    moderators = ModeratorDirectory(subreddit)
+    subreddit_tracker = SubredditTracker(subreddit, local_store, moderators)
+    reddit_handler = RedditActionsHandler(reddit, subreddit, discord_client, local_store, moderators)
+    reddit_handler.start_summary_digest()
+    # warm the rules cache so the first removal doesn't wait on it
+    reddit_handler.removal_reasons.get_rule_messages()
+    create_modlog_thread(bot_password, bot_username, client_id, client_secret,
+                         discord_client, reddit_handler, subreddit_name)
+    resume_unfinished_commands(discord_client, action_queue, subreddit_tracker, reddit_handler)
+    return subreddit_tracker, reddit_handler
+
+
+def create_modlog_thread(bot_password, bot_username, client_id, client_secret,
+                         discord_client, reddit_handler, subreddit_name):
+    reddit = create_reddit(bot_password, bot_username, client_id, client_secret, f"{subreddit_name}.modlog")
     subreddit = reddit.subreddit(subreddit_name)
-    subreddit_tracker = SubredditTracker(subreddit)
-    reddit_handler = RedditActionsHandler(reddit, subreddit, discord_client)
+    reddit_handler.ban_history.backfill(subreddit, reddit_handler)
+    modlog_tailer = ModlogTailer(subreddit, discord_client)
+    modlog_tailer.add_listener(reddit_handler.ban_history.handle_mod_action)
+    # refreshed with the modlog thread's own reddit instance
+    modlog_tailer.add_listener(lambda mod_action: reddit_handler.moderators.handle_mod_action(mod_action, subreddit))
+    modlog_tailer.add_listener(reddit_handler.recent_removals.handle_mod_action,
+                               on_start=reddit_handler.recent_removals.reset)
+    thread = ResilientThread(discord_client, f"{subreddit_name}-Modlog", target=modlog_tailer.run,
+                             circuit_breaker=circuit_breakers.get(subreddit_name))
+    thread.start()
+    stream_watchdog.watch(thread)
+    return modlog_tailer
+
+
+def create_usernotes_thread(bot_password, bot_username, client_id, client_secret,
+                            discord_client, local_store, action_queue, subreddit_name):
+    print(f"Creating {subreddit_name} subreddit thread")
+    subreddit_tracker, reddit_handler = create_subreddit_handler(bot_password, bot_username,
+                                                                 client_id, client_secret,
+                                                                 discord_client, local_store, action_queue,
+                                                                 subreddit_name)
     thread = ResilientThread(discord_client, f"{subreddit_name}-Usernotes",
-                             target=handle_comment_stream, args=(discord_client, subreddit_tracker, reddit_handler))
+                             target=handle_comment_stream,
+                             args=(discord_client, action_queue, subreddit_tracker, reddit_handler),
+                             circuit_breaker=circuit_breakers.get(subreddit_name))
     thread.start()
+    stream_watchdog.watch(thread)
     print(f"Created {subreddit_name} subreddit thread")
-    return reddit_handler
+    return subreddit_tracker, reddit_handler
 
 
-def handle_comment_stream(discord_client, subreddit_tracker, reddit_handler):
+def create_multiplexed_thread(bot_password, bot_username, client_id, client_secret,
+                              discord_client, action_queue, stream_routes):
+    # stream_routes: lower-cased subreddit name -> (SubredditTracker, RedditActionsHandler)
+    combined_name = "+".join(subreddit_tracker.subreddit.display_name
+                             for subreddit_tracker, _ in stream_routes.values())
+    print(f"Creating multiplexed subreddit thread for {combined_name}")
+
+    # the combined stream only reads, actions still go through each subreddit's own reddit instance
+    reddit = create_reddit(bot_password, bot_username, client_id, client_secret, "multiplexed")
+    combined_subreddit = reddit.subreddit(combined_name)
+    thread = ResilientThread(discord_client, "Multiplexed-Usernotes",
+                             target=handle_multiplexed_comment_stream,
+                             args=(discord_client, action_queue, combined_subreddit, stream_routes),
+                             circuit_breaker=circuit_breakers.get(combined_name))
+    thread.start()
+    stream_watchdog.watch(thread)
+    print(f"Created multiplexed subreddit thread for {combined_name}")
+
+
+def handle_comment_stream(discord_client, action_queue, subreddit_tracker, reddit_handler):
     subreddit = subreddit_tracker.subreddit
 
-    for comment in subreddit.stream.comments():
-        if comment.author not in subreddit_tracker.get_cached_mods():
+    for comment in watched_stream(subreddit.stream.comments):
+        handle_comment(discord_client, action_queue, subreddit_tracker, reddit_handler, comment)
+
+
+def handle_multiplexed_comment_stream(discord_client, action_queue, combined_subreddit, stream_routes):
+    # one listing poll for all subreddits, each comment is routed to its own subreddit's tracker and handler
+    for comment in watched_stream(combined_subreddit.stream.comments):
+        route = stream_routes.get(comment.subreddit.display_name.lower())
+        # removed whilst running, the combined stream keeps polling it until it's restarted
+        if not route:
             continue
-        try:
+        subreddit_tracker, reddit_handler = route
+        handle_comment(discord_client, action_queue, subreddit_tracker, reddit_handler, comment)
+
+
+def handle_comment(discord_client, action_queue, subreddit_tracker, reddit_handler, comment):
+    checkpoint = subreddit_tracker.checkpoint
+    is_command = comment.body.split(" ")[0] in command_types
+    # streams replay recent comments on restart, only commands which never finished are picked up again
+    if checkpoint.is_seen(comment) and not (is_command and checkpoint.is_unfinished(comment.id)):
+        return
+    checkpoint.mark_seen(comment)
+    metrics.observe("usernotebot_stream_lag_seconds", time.time() - comment.created_utc,
+                    subreddit=subreddit_tracker.subreddit.display_name)
+    if not subreddit_tracker.moderators.is_removal_mod(comment.author):
+        return
+    if not is_command:
+        return
+    if checkpoint.get_command_status(comment.id) == "done" or comment.id in checkpoint.in_flight:
+        return
+    # pending is saved before the position, so a crash in between leaves the command to be resumed
+    queue_mod_command(discord_client, action_queue, subreddit_tracker, reddit_handler, comment)
+    checkpoint.mark_seen(comment, force_save=True)
+
+
+def queue_mod_command(discord_client, action_queue, subreddit_tracker, reddit_handler, comment):
+    subreddit_tracker.checkpoint.mark_command(comment.id, "pending")
+    action_queue.submit(f"{subreddit_tracker.subreddit.display_name} {comment.id}",
+                        lambda: execute_mod_command(discord_client, subreddit_tracker, reddit_handler, comment))
+
+
+def resume_unfinished_commands(discord_client, action_queue, subreddit_tracker, reddit_handler):
+    # commands interrupted by a restart are requeued, their journal skips the steps already done
+    for comment_id in subreddit_tracker.checkpoint.get_unfinished_commands():
+        print(f"Resuming unfinished command {subreddit_tracker.subreddit.display_name} {comment_id}")
+        queue_mod_command(discord_client, action_queue, subreddit_tracker, reddit_handler,
+                          reddit_handler.reddit.comment(comment_id))
+
+
+def execute_mod_command(discord_client, subreddit_tracker, reddit_handler, comment):
+    # the subreddit was removed whilst this was queued, it's left pending and resumed if it's added back
+    if reddit_handler.is_closed:
+        print(f"Skipping {subreddit_tracker.subreddit.display_name} {comment.id}, the subreddit was removed")
+        return
+    try:
+        # reads for the command, such as the content it replies to, are on the way to removing it
+        with reddit_rate_limiter.prioritized("enforcement"):
             handle_mod_response(discord_client, subreddit_tracker, reddit_handler, comment)
-        except Exception as e:
-            message = f"Exception in comment processing: {e}\n```{traceback.format_exc()}```"
-            discord_client.send_error_msg(message)
-            print(message)
-            reddit_handler.send_message(comment.author, "Error during removal request processing",
-                                        f"I've encountered an error whilst actioning your request:"
-                                        f"  \n\n"
-                                        f"URL: https://www.reddit.com{comment.permalink}  \n\n"
-                                        f"Error: {e}\n\n"
-                                        f"Please review to ensure all is as expected. "
-                                        f"If your command is in the correct format, "
-                                        f"e.g. \".r 1,2,3\", please raise this issue to the developers")
+    except Exception as e:
+        if reddit_handler.is_closed:
+            # cut short by the subreddit being removed, its journal skips the steps already done once resumed
+            print(f"Left {subreddit_tracker.subreddit.display_name} {comment.id} pending, the subreddit was removed")
+            return
+        message = f"Exception in comment processing: {e}\n```{traceback.format_exc()}```"
+        discord_client.send_error_msg(message)
+        print(message)
+        reddit_handler.send_message(comment.author, "Error during removal request processing",
+                                    f"I've encountered an error whilst actioning your request:"
+                                    f"  \n\n"
+                                    f"URL: https://www.reddit.com{comment.permalink}  \n\n"
+                                    f"Error: {e}\n\n"
+                                    f"Please review to ensure all is as expected. "
+                                    f"If your command is in the correct format, "
+                                    f"e.g. \".r 1,2,3\", please raise this issue to the developers")
+    finally:
+        if not reddit_handler.is_closed:
+            subreddit_tracker.checkpoint.mark_command(comment.id, "done")
+            reddit_handler.journal.clear(comment.id)
+            # from the mod posting the command to the last reddit call finishing
+            metrics.observe("usernotebot_command_seconds", time.time() - comment.created_utc,
+                            subreddit=subreddit_tracker.subreddit.display_name, command=comment.body.split(" ")[0])
 
 
 def handle_mod_response(discord_client, subreddit_tracker, reddit_handler, mod_comment):
@@ -106,14 +384,15 @@ def handle_mod_response(discord_client, subreddit_tracker, reddit_handler, mod_c
     # input must be space separated
     remaining_commands = mod_comment.body.split(" ")
     command_type = remaining_commands[0]
-    if command_type not in [".r", ".n", ".u"]:
+    if command_type not in command_types:
         return
     # remaining_command always exists, so remove it
     remaining_commands.remove(command_type)
     action_request = f"Action request {subreddit.display_name} {mod_comment.author.name}: {mod_comment.permalink}"
     print(action_request)
 
-    if not mod_comment.author or mod_comment.removed:
+    # the bot removes the mod comment itself, so a command resumed after a restart may already be removed
+    if not mod_comment.author or (mod_comment.removed and not reddit_handler.journal.has_entries(mod_comment.id)):
         print("Ignoring - mod comment is removed, should already be actioned")
         return
 
@@ -129,7 +408,7 @@ def handle_mod_response(discord_client, subreddit_tracker, reddit_handler, mod_c
 
     # non-full mods cannot remove posts
     if command_type == ".r" and isinstance(actionable_content, Submission) and \
-            (mod_comment.author.name not in subreddit_tracker.full_mods):
+            not subreddit_tracker.moderators.is_full_mod(mod_comment.author.name):
         reddit_handler.remove_content("Mod removal request: mod", mod_comment)
         reddit_handler.send_message(mod_comment.author, "Error during removal request",
                                     f"I could not remove this post, as you are a comment mod:\n\n"
@@ -149,11 +428,17 @@ def handle_mod_response(discord_client, subreddit_tracker, reddit_handler, mod_c
     # normalize ban command without the B
     ban_command = remaining_commands[0][1:] \
         if (remaining_commands and remaining_commands[0].startswith("b")) else ""
-    ban_type = find_ban(discord_client, subreddit, actionable_content.author, ban_command)
+    # a resumed command bans for what it worked out the first time, its ban may since be in the ban history
+    ban_type = reddit_handler.journal.get_recorded(mod_comment.id, "ban_type") if ban_command else None
+    if not ban_type:
+        ban_type = find_ban(discord_client, subreddit, actionable_content.author, ban_command,
+                            reddit_handler.ban_history)
+        if ban_type:
+            reddit_handler.journal.record(mod_comment.id, "ban_type", ban_type)
     if ban_type:
         remaining_commands.remove(remaining_commands[0])
         # non-FMs can't ban, overwrite to empty
-        if mod_comment.author.name not in subreddit_tracker.full_mods:
+        if not subreddit_tracker.moderators.is_full_mod(mod_comment.author.name):
             discord_client.send_error_msg(f"Detected ban attempt from a non-FM:\n\n{action_request}")
             ban_type = None
 
@@ -161,30 +446,34 @@ def handle_mod_response(discord_client, subreddit_tracker, reddit_handler, mod_c
 
     rules_str = ("R" + ",".join(str(x) for x in cited_rules)) if len(cited_rules) > 0 else "No cited rules"
     full_note = f"[{mod_comment.author.name}] {rules_str}: {message if message else ''}"
+    # independent steps run concurrently, the summary waits on everything so it only reports what was done
+    plan = ActionPlan(f"{subreddit.display_name} {mod_comment.id}", reddit_handler.journal, mod_comment.id)
+    plan.add("remove_mod_comment", lambda: reddit_handler.remove_content("Mod removal request: mod", mod_comment))
+    # raises if the usernote could not be written
+    plan.add("usernote",
+             lambda: reddit_handler.write_usernote(url, actionable_content.author.name, None, full_note).result())
     if command_type == ".r":
         print(f"Removing+Usernoting: {actionable_content.author.name} for {rules_str}: {actionable_content.permalink}")
-        reddit_handler.remove_content("Mod removal request: mod", mod_comment)
-        reddit_handler.write_removal_reason(actionable_content, cited_rules)
-        reddit_handler.remove_content("Mod removal request: user", actionable_content)
-        reddit_handler.write_usernote(url, actionable_content.author.name, None, full_note)
+        reddit_handler.plan_removal_reason(plan, actionable_content, cited_rules)
+        plan.add("remove_content",
+                 lambda: reddit_handler.remove_content("Mod removal request: user", actionable_content))
         internal_detail = f"Usernotes command by {mod_comment.author.name} for {full_note}"
         if ban_type:
-            reddit_handler.ban_user(actionable_content.author.name, rules_str, internal_detail, ban_type)
+            plan.add("ban", lambda: reddit_handler.ban_user(actionable_content.author.name, rules_str,
+                                                            internal_detail, ban_type))
         ban_message = ("Ban:" + (ban_type if ban_type.isnumeric() else "Perm" + " " + internal_detail)
                        if ban_type else "")
-        reddit_handler.send_message(mod_comment.author, "Bot Action Summary",
-                                    f"I have performed the following:\n\n"
-                                    f"URL: https://www.reddit.com{actionable_content.permalink}  \n\n"
-                                    f"Usernote detail: {full_note}\n\n"
-                                    f"{ban_message}")
+        summary = f"URL: https://www.reddit.com{actionable_content.permalink}  \n\n" \
+                  f"Usernote detail: {full_note}\n\n" \
+                  f"{ban_message}"
     elif command_type in [".n", ".u"]:
         print(f"Usernoting: {actionable_content.author.name} for {rules_str}: {actionable_content.permalink}")
-        reddit_handler.remove_content("Mod removal request: mod", mod_comment)
-        reddit_handler.write_usernote(url, actionable_content.author.name, None, full_note)
-        reddit_handler.send_message(mod_comment.author, "Bot Action Summary",
-                                    f"I have performed the following:\n\n"
-                                    f"URL: https://www.reddit.com{actionable_content.permalink}  \n\n"
-                                    f"Usernote detail: {full_note}\n\n")
+        summary = f"URL: https://www.reddit.com{actionable_content.permalink}  \n\n" \
+                  f"Usernote detail: {full_note}\n\n"
+    # sent straight away, or added to the mod's digest if the subreddit has them enabled
+    plan.add("summary", lambda: reddit_handler.send_summary(mod_comment.author, summary),
+             depends_on=list(plan.steps))
+    plan.execute()
 
 
 if __name__ == "__main__":
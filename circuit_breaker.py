@@ -0,0 +1,135 @@
+import random
+import threading
+import time
+
+from prawcore.exceptions import RequestException, ServerError, TooManyRequests
+
+from metrics import metrics
+
+# reddit being down or unreachable, rather than rejecting a particular call
+transient_errors = (ServerError, RequestException, TooManyRequests)
+failure_threshold = 5
+min_open_secs = 30
+max_open_secs = 10 * 60
+# a probe which hasn't succeeded or failed by then, e.g. a stuck call, lets another probe through
+probe_timeout_secs = 60
+# how often a stopped thread waiting on an open circuit notices
+stop_check_secs = 5
+circuit_states = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class Backoff:
+    # exponential delays with jitter, so threads failing together don't all retry together
+    def __init__(self, base_secs, max_secs):
+        self.base_secs = base_secs
+        self.max_secs = max_secs
+        self.failures = 0
+
+    def next_delay(self):
+        delay_secs = min(self.max_secs, self.base_secs * 2 ** self.failures)
+        self.failures += 1
+        return random.uniform(delay_secs / 2, delay_secs)
+
+    def reset(self):
+        self.failures = 0
+
+
+class CircuitBreaker:
+    # after failure_threshold transient failures in a row, calls stop for a while rather than keep hitting reddit.
+    # a single probe call is then let through (half open), closing the circuit if it works and reopening it,
+    # for twice as long, if it doesn't
+    def __init__(self, subreddit_name):
+        self.subreddit_name = subreddit_name
+        self.condition = threading.Condition()
+        self.state = "closed"
+        self.failures = 0
+        self.open_backoff = Backoff(min_open_secs, max_open_secs)
+        self.retry_time = 0
+        self.probe_time = 0
+        self.set_state("closed")
+
+    def before_call(self, wait=True, stop_event=None):
+        # blocks until a call may be made, or raises CircuitOpenError when not waiting.
+        # returns False if stop_event is set whilst waiting
+        with self.condition:
+            while True:
+                if self.state == "closed":
+                    return True
+                if (self.state == "open" and time.time() >= self.retry_time) or \
+                        (self.state == "half_open" and time.time() >= self.probe_time + probe_timeout_secs):
+                    # this call is the probe, others wait on its outcome
+                    self.probe_time = time.time()
+                    self.set_state("half_open")
+                    return True
+                if not wait:
+                    raise CircuitOpenError(f"Reddit calls for {self.subreddit_name} are paused after repeated "
+                                           f"failures, retrying in {self.seconds_to_retry():.0f}s")
+                if stop_event and stop_event.is_set():
+                    return False
+                wait_secs = self.seconds_to_retry()
+                if stop_event:
+                    wait_secs = min(wait_secs, stop_check_secs)
+                self.condition.wait(wait_secs)
+
+    def record_success(self):
+        with self.condition:
+            self.failures = 0
+            if self.state != "closed":
+                print(f"Circuit for {self.subreddit_name} closed, reddit is responding again")
+                self.open_backoff.reset()
+                self.set_state("closed")
+                self.condition.notify_all()
+
+    def record_failure(self):
+        with self.condition:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= failure_threshold):
+                open_secs = self.open_backoff.next_delay()
+                self.retry_time = time.time() + open_secs
+                print(f"Circuit for {self.subreddit_name} opened after {self.failures} failures, "
+                      f"probing again in {open_secs:.0f}s")
+                metrics.increment("usernotebot_circuit_opened_total", subreddit=self.subreddit_name)
+                self.set_state("open")
+                self.condition.notify_all()
+
+    def record(self, error):
+        # anything but a transient error means reddit responded
+        if isinstance(error, transient_errors):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def seconds_to_retry(self):
+        # until the next probe may be let through
+        retry_time = self.retry_time if self.state == "open" else self.probe_time + probe_timeout_secs
+        return max(retry_time - time.time(), 0)
+
+    def set_state(self, state):
+        self.state = state
+        metrics.set_gauge("usernotebot_circuit_state", circuit_states[state], subreddit=self.subreddit_name)
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = dict()
+
+    def get(self, subreddit_name):
+        with self.lock:
+            key = subreddit_name.lower()
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(subreddit_name)
+            return self.breakers[key]
+
+    def remove(self, subreddit_name):
+        with self.lock:
+            self.breakers.pop(subreddit_name.lower(), None)
+
+
+# one breaker per subreddit, shared by its streams, mod actions and reads, so reddit failing for any of them pauses
+# them all rather than each finding out on its own
+circuit_breakers = CircuitBreakerRegistry()
@@ -10,3 +10,12 @@ DISCORD_ERROR_GUILD = 'SomeDiscord'
 DISCORD_ERROR_CHANNEL = 'SomeDiscordChannel'
 DISCORD_COLLAPSE_GUILD = 'AnotherDiscord'
 SUBREDDITS = 'Subreddit'
+SUBREDDITS_PATH = ''
+MULTIPLEX_STREAMS = 'False'
+SUPERVISOR_MODE = 'False'
+ACTION_WORKERS = '2'
+ACTION_QUEUE_SIZE = '100'
+LOCAL_STORE_PATH = 'usernotebot.db'
+METRICS_PORT = '9091'
+METRICS_HOST = '127.0.0.1'
+REDDIT_POOL_SIZE = '10'
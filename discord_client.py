@@ -1,14 +1,19 @@
 import asyncio
+import threading
+import time
 import traceback
 import typing
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 from discord import ui
 from discord.ext import commands
-from prawcore import NotFound
 
+from error_reporter import ErrorReporter
+from metrics import metrics
 from settings import Settings
-from usernote_utils import find_rules, find_ban
+from usernote_utils import find_rules
+from usernotes_compactor import format_report
 
 usernote_brief = "Used to create toolbox usernotes and removal comments"
 usernote_description = f"{usernote_brief}\n" \
@@ -56,6 +61,11 @@ def get_username(guild, user):
     return "Unknown Name"
 
 
+# reddit calls from discord are blocking, they run here so they never stall the discord event loop
+reddit_executor_workers = 4
+error_flush_interval_secs = 30
+
+
 class DiscordClient(commands.Bot):
     def __init__(self, error_guild_name, error_guild_channel):
         super().__init__('.', intents=discord.Intents.all())
@@ -64,24 +74,61 @@ class DiscordClient(commands.Bot):
         self.error_guild = None
         self.error_channel = None
         self.is_ready = False
+        # set on the first on_ready, run_forever waits on it rather than polling
+        self.ready_event = threading.Event()
+        self.ready_time = None
         self.guild_reddit_map = dict()
+        self.action_queue = None
+        self.subreddit_manager = None
+        # per-subreddit worker processes, in supervisor mode
+        self.subreddit_workers = list()
+        self.reddit_executor = ThreadPoolExecutor(max_workers=reddit_executor_workers,
+                                                  thread_name_prefix="DiscordReddit")
+        self.error_reporter = ErrorReporter()
+        self.error_flush_task = None
 
     async def on_ready(self):
         print(f'{self.user} has connected to Discord!')
         self.error_guild = discord.utils.get(self.guilds, name=self.error_guild_name)
         self.error_channel = discord.utils.get(self.error_guild.channels, name=self.error_channel_name)
         self.is_ready = True
+        if not self.ready_event.is_set():
+            self.ready_time = time.time()
+            self.ready_event.set()
         guilds_msg = "\n".join([f"\t{guild.name}" for guild in self.guilds])
         startup_message = f"{self.user} is in the following guilds:\n" \
                           f"{guilds_msg}"
         print(startup_message)
+        # on_ready is called again on reconnects
+        if not self.error_flush_task:
+            self.error_flush_task = self.loop.create_task(self.flush_errors())
         await self.error_channel.send(f"I am online for Usernotes script, is_dry_run={Settings.is_dry_run}. Listening on=.")
 
+    async def on_command(self, ctx):
+        ctx.start_time = time.time()
+
+    async def on_command_completion(self, ctx):
+        metrics.observe("usernotebot_discord_command_seconds", time.time() - ctx.start_time,
+                        command=ctx.command.name)
+
+    async def run_reddit(self, callback):
+        return await self.loop.run_in_executor(self.reddit_executor, callback)
+
     def send_error_msg(self, message):
-        full_message = f"Usernotes script has had an exception. This can normally be ignored, " \
-                       f"but if it's occurring frequently, may indicate a script error.\n{message}"
-        if self.error_channel:
-            asyncio.run_coroutine_threadsafe(self.error_channel.send(full_message), self.loop)
+        # batched and deduplicated, sent by flush_errors
+        self.error_reporter.add(message)
+
+    async def flush_errors(self):
+        while True:
+            await asyncio.sleep(error_flush_interval_secs)
+            messages = self.error_reporter.drain()
+            for index, message in enumerate(messages):
+                try:
+                    await self.error_channel.send(message)
+                except Exception as e:
+                    print(f"Exception sending error messages to discord: {e}\n{traceback.format_exc()}")
+                    self.error_reporter.requeue(messages[index:])
+                    break
 
     def add_commands(self):
         @self.command(name="ping", description="lol")
@@ -100,11 +147,126 @@ class DiscordClient(commands.Bot):
                       usage=".set_dry_run 1")
         async def set_dry_run(ctx, dry_run: typing.Literal[0, 1] = 1):
             Settings.is_dry_run = dry_run
+            for worker in self.subreddit_workers:
+                worker.set_dry_run(dry_run)
             if Settings.is_dry_run:
                 await ctx.channel.send(f"I am now running in dry run mode")
             else:
                 await ctx.channel.send(f"I am now NOT running in dry run mode")
 
+        @self.command(name="queue", brief="Shows the mod command queue depth and wait times",
+                      description="Shows how many reddit mod commands are waiting to be actioned, "
+                                  "and how long they have waited in the queue", usage=".queue")
+        async def queue(ctx):
+            if not self.action_queue:
+                await ctx.channel.send("Action queue is not running")
+                return
+            stats = self.action_queue.get_stats()
+            await ctx.channel.send(f"Action queue: {stats['depth']}/{stats['max_size']} waiting, "
+                                   f"{stats['workers']} workers, {stats['processed']} processed\n"
+                                   f"Wait time: last {stats['last_wait_secs']:.1f}s, "
+                                   f"avg {stats['avg_wait_secs']:.1f}s, max {stats['max_wait_secs']:.1f}s")
+
+        @self.command(name="stats", brief="Shows bot latency and throughput metrics",
+                      description="Shows stream lag, reddit action latencies, retries, throttling "
+                                  "and discord command latency. From a subreddit's discord server, "
+                                  "only that subreddit's metrics are shown", usage=".stats")
+        async def stats(ctx):
+            subreddit = None
+            if ctx.guild and ctx.guild in self.guild_reddit_map:
+                subreddit = self.guild_reddit_map[ctx.guild].subreddit_name
+            stats_message = metrics.format_stats(subreddit) or "No metrics recorded yet"
+            # discord messages are limited to 2000 characters
+            for i in range(0, len(stats_message), 1990):
+                await ctx.send(f"```{stats_message[i:i + 1990]}```")
+
+        @self.command(name="refresh_rules", brief="Reloads subreddit rules used in removal comments",
+                      description="Subreddit rules are cached for removal comments. "
+                                  "Use this after editing the subreddit's rules so removal comments use them",
+                      usage=".refresh_rules")
+        async def refresh_rules(ctx):
+            guild = ctx.guild
+            if not guild or guild not in self.guild_reddit_map:
+                await ctx.send("Cannot use - I don't know this discord server - contact developers")
+                return
+            reddit_actions_handler = self.guild_reddit_map[guild]
+            await self.run_reddit(reddit_actions_handler.refresh_rules)
+            await ctx.send(f"Rules for r/{reddit_actions_handler.subreddit_name} "
+                           f"will be reloaded on the next removal comment")
+
+        @self.command(name="compact_usernotes", brief="Archives old usernotes to keep the usernotes page small",
+                      description="Moves usernotes older than the given number of days, and usernotes for deleted "
+                                  "or suspended accounts, to the usernotes_archive wiki page. "
+                                  "Reports the usernotes page size and decode time before and after. "
+                                  "Needs wiki permissions on reddit\n"
+                                  "Include: \n"
+                                  "  * archive age in days (optional, defaults to the subreddit's settings)\n"
+                                  "  * 0 to skip checking accounts, which is one reddit call per usernoted user",
+                      usage=".compact_usernotes 730 1")
+        async def compact_usernotes(ctx, archive_age_days: typing.Optional[int] = None,
+                                    check_accounts: typing.Literal[0, 1] = 1):
+            try:
+                guild = ctx.guild
+                if not guild or guild not in self.guild_reddit_map:
+                    await ctx.send("Cannot use - I don't know this discord server - contact developers")
+                    return
+                reddit_actions_handler = self.guild_reddit_map[guild]
+                mod = get_username(guild, ctx.author)
+                mod_permissions = await self.run_reddit(lambda: reddit_actions_handler.get_mod_permissions(mod))
+                if not mod_permissions or not mod_permissions & {"all", "wiki"}:
+                    await ctx.send(f"Cannot compact usernotes - {mod} needs wiki permissions on reddit")
+                    return
+                print(f"Received usernotes compaction request from {mod} in guild [{str(guild)}]")
+                await ctx.send(f"Compacting r/{reddit_actions_handler.subreddit_name} usernotes, "
+                               f"this can take a while")
+                async with ctx.typing():
+                    report = await self.run_reddit(
+                        lambda: reddit_actions_handler.compact_usernotes(archive_age_days, check_accounts))
+                await ctx.send(f"```{format_report(reddit_actions_handler.subreddit_name, report)}```")
+            except Exception as ex:
+                error_msg = f"Exception compacting usernotes: {ex}\n```{traceback.format_exc()}```"
+                self.send_error_msg(error_msg)
+                print(error_msg)
+                await ctx.send(f"Usernotes compaction failed: {ex}")
+
+        @self.command(name="subreddits", brief="Lists the subreddits the bot is running",
+                      description="Lists the subreddits the bot is running, their discord servers "
+                                  "and any settings changed from their defaults", usage=".subreddits")
+        async def subreddits(ctx):
+            await self.change_subreddits(ctx, self.subreddit_manager.describe)
+
+        @self.command(name="add_subreddit", brief="Starts running a subreddit without restarting the bot",
+                      description="Starts a subreddit's streams and usernote commands, other subreddits carry on "
+                                  "uninterrupted. Also saved to the subreddits file, if there is one. "
+                                  "Only for administrators of the bot's error server\n"
+                                  "Include: \n"
+                                  "  * subreddit name\n"
+                                  "  * discord server for its usernote commands (optional, defaults to its settings)",
+                      usage=".add_subreddit Collapse Collapse Moderators")
+        async def add_subreddit(ctx, subreddit_name: str, *, guild_name: typing.Optional[str] = None):
+            overrides = {"guild_name": guild_name} if guild_name else dict()
+            await self.change_subreddits(ctx, lambda: self.subreddit_manager.add(subreddit_name, overrides))
+
+        @self.command(name="remove_subreddit", brief="Stops running a subreddit without restarting the bot",
+                      description="Stops a subreddit's streams and usernote commands, after writing any usernotes "
+                                  "and summaries it has buffered. Other subreddits carry on uninterrupted. "
+                                  "Only for administrators of the bot's error server",
+                      usage=".remove_subreddit Collapse")
+        async def remove_subreddit(ctx, subreddit_name: str):
+            await self.change_subreddits(ctx, lambda: self.subreddit_manager.remove(subreddit_name))
+
+        @self.command(name="configure_subreddit", brief="Changes a subreddit's setting without restarting the bot",
+                      description="Changes a setting from settings.py for one subreddit, applied straight away "
+                                  "without restarting its streams. Only for administrators of the bot's error server\n"
+                                  "Include: \n"
+                                  "  * subreddit name\n"
+                                  "  * setting, e.g. guild_name or summary_digest_interval_secs\n"
+                                  "  * value (optional, leave out to go back to the default)",
+                      usage=".configure_subreddit Collapse summary_digest_interval_secs 3600")
+        async def configure_subreddit(ctx, subreddit_name: str, setting: str, *, value: typing.Optional[str] = None):
+            await self.change_subreddits(ctx, lambda: self.subreddit_manager.set_setting(subreddit_name, setting,
+                                                                                         value))
+
         @self.command(aliases=["q", "qn", "query"],
                       description="Queries usernotes", brief="Queries usernotes", usage=".q")
         async def query_usernotes(ctx, username: typing.Optional[str] = ""):
@@ -130,29 +292,27 @@ class DiscordClient(commands.Bot):
                     return
 
                 reddit_actions_handler = self.guild_reddit_map[guild]
-                subreddit = reddit_actions_handler.subreddit
                 mod = get_username(guild, ctx.author)
                 print(f"Received query request: {mod} {str(username)} "
                       f"from guild [{str(guild)}], channel [{str(ctx.channel)}]")
-                subreddit_mod = subreddit.moderator(mod)
-                if not subreddit_mod:
+                mod_permissions = await self.run_reddit(lambda: reddit_actions_handler.get_mod_permissions(mod))
+                if mod_permissions is None:
                     user_response = f"I cannot find a moderator with name: {mod}. " \
                                     f"Please change your discord or server name, or contact developers"
                     print(user_response)
                     await ctx.send(user_response)
                     return
-                try:
-                    reddit_actions_handler.reddit.redditor(username).id
-                except NotFound:
+                async with ctx.typing():
+                    redditor_exists = await self.run_reddit(lambda: reddit_actions_handler.redditor_exists(username))
+                if not redditor_exists:
                     user_response = f"I cannot find a user with name: {username}. Please match their username exactly."
                     print(user_response)
                     await ctx.send(user_response)
                     return
 
-                try:
-                    notes = reddit_actions_handler.toolbox.usernotes.list_notes(username, reverse=True)
-                except KeyError:
-                    # raised if user isn't in toolbox usernotes
+                async with ctx.typing():
+                    notes = await self.run_reddit(lambda: reddit_actions_handler.get_usernotes(username))
+                if not notes:
                     message = f"```" \
                               f"Usernote History for {username} (https://reddit.com/u/{username})\n" \
                               f"Number of Usernotes: No Usernotes\n\n" \
@@ -194,49 +354,41 @@ class DiscordClient(commands.Bot):
                     return
 
                 reddit_actions_handler = self.guild_reddit_map[guild]
-                subreddit = reddit_actions_handler.subreddit
                 mod = get_username(guild, ctx.author)
                 print(f"Received action request: {mod} {str(num_retrieved_mod_removals)} "
                       f"from guild [{str(guild)}], channel [{str(ctx.channel)}]")
-                subreddit_mod = subreddit.moderator(mod)
-                if not subreddit_mod:
+                mod_permissions = await self.run_reddit(lambda: reddit_actions_handler.get_mod_permissions(mod))
+                if mod_permissions is None:
                     user_response = f"I cannot find a moderator with name: {mod}. " \
                                     f"Please change your discord or server name, or contact developers"
                     print(user_response)
                     await ctx.send(user_response)
                     return
                 # all and access permissions allows to ban
-                can_ban = any(x in ["all", "access"] for x in subreddit_mod[0].mod_permissions)
-                actions_count = 0
-                for mod_action in subreddit.mod.log(mod=mod):
-                    if mod_action.action in ["removecomment", "removelink"]:
-                        actions_count += 1
-                        is_comment = True if mod_action.action == "removecomment" else False
-                        embed = discord.Embed(title="Mod Action Summary",
-                                              url=f"https://reddit.com{mod_action.target_permalink}", color=0xFF5733)
-                        embed.add_field(name="Acting Mod", value=mod_action.mod, inline=True)
-                        embed.add_field(name="Action Type",
-                                        value="Removed Comment" if is_comment else "Removed Post", inline=True)
-                        embed.add_field(name="Target User", value=mod_action.target_author, inline=True)
-                        embed.add_field(name="URL", value=mod_action.target_permalink, inline=False)
-                        if is_comment:
-                            comment_truc = (mod_action.target_body[:300] + '...') \
-                                if len(mod_action.target_body) > 300 else mod_action.target_body
-                            embed.add_field(name="Comment Body", value=comment_truc, inline=False)
-                        else:
-                            embed.add_field(name="Post Title", value=mod_action.target_title, inline=False)
-                        embed.set_footer(text=f"I will monitor this message for 5 minutes. Requested by {mod}")
-                        content_id = mod_action.target_fullname
-                        if is_comment:
-                            content = reddit_actions_handler.reddit.comment(content_id)
-                        else:
-                            content = reddit_actions_handler.reddit.submission(content_id)
-                        await ctx.send(embed=embed, view=MyView(guild, reddit_actions_handler,
-                                                                is_comment, can_ban, content))
-                    if actions_count >= num_retrieved_mod_removals:
-                        break
+                can_ban = any(x in ["all", "access"] for x in mod_permissions)
+                async with ctx.typing():
+                    mod_removals = await self.run_reddit(
+                        lambda: reddit_actions_handler.get_recent_removals(mod, num_retrieved_mod_removals))
+                for mod_action in mod_removals:
+                    is_comment = True if mod_action.action == "removecomment" else False
+                    embed = discord.Embed(title="Mod Action Summary",
+                                          url=f"https://reddit.com{mod_action.target_permalink}", color=0xFF5733)
+                    embed.add_field(name="Acting Mod", value=mod_action.mod, inline=True)
+                    embed.add_field(name="Action Type",
+                                    value="Removed Comment" if is_comment else "Removed Post", inline=True)
+                    embed.add_field(name="Target User", value=mod_action.target_author, inline=True)
+                    embed.add_field(name="URL", value=mod_action.target_permalink, inline=False)
+                    if is_comment:
+                        comment_truc = (mod_action.target_body[:300] + '...') \
+                            if len(mod_action.target_body) > 300 else mod_action.target_body
+                        embed.add_field(name="Comment Body", value=comment_truc, inline=False)
+                    else:
+                        embed.add_field(name="Post Title", value=mod_action.target_title, inline=False)
+                    embed.set_footer(text=f"I will monitor this message for 5 minutes. Requested by {mod}")
+                    await ctx.send(embed=embed, view=MyView(guild, reddit_actions_handler,
+                                                            is_comment, can_ban, mod_action.target_fullname))
                 # no actions found for a mod, so that probably means provided mod name doesn't exist
-                if actions_count < num_retrieved_mod_removals:
+                if len(mod_removals) < num_retrieved_mod_removals:
                     user_response = f"I found no actions for {mod}. " \
                                     f"Please change your discord or server name, or contact developers"
                     print(user_response)
@@ -247,22 +399,48 @@ class DiscordClient(commands.Bot):
                 print(error_msg)
 
     def add_usernote_guild(self, guild_name, reddit_handler):
-        print(f'Adding discord usernote guild {guild_name} for {reddit_handler.subreddit.display_name}')
+        print(f'Adding discord usernote guild {guild_name} for {reddit_handler.subreddit_name}')
         guild = discord.utils.get(self.guilds, name=guild_name)
         if not guild:
-            print(f'ERROR: cannot find guild {guild_name} for {reddit_handler.subreddit.display_name}')
+            print(f'ERROR: cannot find guild {guild_name} for {reddit_handler.subreddit_name}')
         self.guild_reddit_map[guild] = reddit_handler
+        return guild is not None
+
+    def remove_usernote_guild(self, reddit_handler):
+        for guild in [guild for guild, handler in self.guild_reddit_map.items() if handler is reddit_handler]:
+            print(f'Removing discord usernote guild {guild} for {reddit_handler.subreddit_name}')
+            del self.guild_reddit_map[guild]
+
+    def is_admin(self, ctx):
+        # subreddit changes affect the whole bot, so only administrators of the error server may make them
+        return ctx.guild is not None and ctx.guild == self.error_guild and \
+            ctx.author.guild_permissions.administrator
+
+    async def change_subreddits(self, ctx, change):
+        try:
+            if not self.is_admin(ctx):
+                await ctx.send(f"Cannot use - only administrators of {self.error_guild_name} can change subreddits")
+                return
+            print(f"Received subreddit change {ctx.message.content} from {ctx.author}")
+            async with ctx.typing():
+                result = await self.run_reddit(change)
+            await ctx.send(result)
+        except Exception as ex:
+            error_msg = f"Exception changing subreddits: {ex}\n```{traceback.format_exc()}```"
+            self.send_error_msg(error_msg)
+            print(error_msg)
+            await ctx.send(f"Subreddit change failed: {ex}")
 
 
 class MyView(discord.ui.View):
 
-    def __init__(self, guild, reddit_actions_handler, is_comment, can_ban, content):
+    def __init__(self, guild, reddit_actions_handler, is_comment, can_ban, content_fullname):
         super().__init__(timeout=300)
         self.reddit_actions_handler = reddit_actions_handler
         self.guild = guild
         self.is_comment = is_comment
         self.can_ban = can_ban
-        self.content = content
+        self.content_fullname = content_fullname
 
     @discord.ui.button(label="Usernote the above action", style=discord.ButtonStyle.green)
     async def usernote(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -280,7 +458,7 @@ class MyView(discord.ui.View):
 
         await interaction.response.send_modal(
             UsernoteModal(self.reddit_actions_handler, action_mod, url, target_user,
-                          self.is_comment, self.can_ban, self.content))
+                          self.is_comment, self.can_ban, self.content_fullname))
         await interaction.message.delete()
 
     @discord.ui.button(label="Remove this message", style=discord.ButtonStyle.red)
@@ -305,7 +483,7 @@ class MyView(discord.ui.View):
 class UsernoteModal(ui.Modal, title="Usernote Creation"):
     default_detail = "none (change to include anything in note beyond rule#)"
 
-    def __init__(self, reddit_actions_handler, mod, url, target_user, is_comment, can_ban, content):
+    def __init__(self, reddit_actions_handler, mod, url, target_user, is_comment, can_ban, content_fullname):
         super().__init__(timeout=300)  # seconds
         self.reddit_actions_handler = reddit_actions_handler
         self.url = "https://www.reddit.com" + url
@@ -313,7 +491,7 @@ class UsernoteModal(ui.Modal, title="Usernote Creation"):
         self.target_user = target_user
         self.is_comment = is_comment
         self.can_ban = can_ban
-        self.content = content
+        self.content_fullname = content_fullname
 
         # self.target_user = ui.TextInput(label="Target User", default=target_user_default)
         self.note_type = ui.TextInput(label="Type (warning, low quality, ban, spam)", default="Warning")
@@ -349,6 +527,11 @@ class UsernoteModal(ui.Modal, title="Usernote Creation"):
         #     await interaction.response.send_message(message, ephemeral=True)
         #     return
 
+        # finding incremental bans may call reddit, so acknowledge within discord's 3 second window first
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        start_time = time.time()
+        discord_client = self.reddit_actions_handler.discord_client
+
         rule_input = self.rule.value
         detail = self.detail.value
         affirmative_responses = ["yes", "y", "ok", "sure", "yeah", "yea", "true", "t", "1"]
@@ -356,9 +539,8 @@ class UsernoteModal(ui.Modal, title="Usernote Creation"):
 
         cited_rules = find_rules(rule_input)
 
-        target_user_redditor = self.reddit_actions_handler.reddit.redditor(self.target_user)
-        ban_type = find_ban(self.reddit_actions_handler.discord_client, self.reddit_actions_handler.subreddit,
-                            target_user_redditor, self.ban_type.value.lower())
+        ban_type = await discord_client.run_reddit(
+            lambda: self.reddit_actions_handler.find_ban_type(self.target_user, self.ban_type.value.lower()))
 
         rules_str = ("R" + ",".join(str(x) for x in cited_rules)) if len(cited_rules) > 0 else "No cited rules"
         full_note = f'[{self.mod}] {rules_str}' + ("" if UsernoteModal.default_detail == detail else ": " + detail)
@@ -370,25 +552,27 @@ class UsernoteModal(ui.Modal, title="Usernote Creation"):
         if Settings.is_dry_run:
             message = f"No action taken - bot is in dry run mode. But I would have done this:\n{message}"
             print(message)
-            await interaction.response.send_message(message, ephemeral=True)
+            await interaction.followup.send(message, ephemeral=True)
             return
 
-        await interaction.response.send_message(message, ephemeral=True)
+        await interaction.followup.send(message, ephemeral=True)
         print(message)
 
         try:
-            self.reddit_actions_handler.write_usernote(self.url, self.target_user, None, full_note)
-            if should_comment:
-                self.reddit_actions_handler.write_removal_reason(self.content, cited_rules)
-            if ban_type:
-                internal_detail = f"Usernotes command by {self.mod} for {full_note}"
-                self.reddit_actions_handler.ban_user(self.target_user, rules_str, internal_detail, ban_type)
+            await discord_client.run_reddit(
+                lambda: self.reddit_actions_handler.take_usernote_actions(
+                    self.mod, self.url, self.target_user, full_note, rules_str, self.content_fullname,
+                    self.is_comment, should_comment, cited_rules, ban_type))
         except Exception as e:
             error_formatted = traceback.format_exc()
             print(error_formatted)
+        metrics.observe("usernotebot_discord_command_seconds", time.time() - start_time, command="usernote_modal")
 
     async def on_error(self, interaction: discord.Interaction, error: Exception):
         error_formatted = traceback.format_exc()
         print(error_formatted)
-        await interaction.response.send_message(
-            f"There has been an error. Please raise to devs.\n{error_formatted}")
+        message = f"There has been an error. Please raise to devs.\n{error_formatted}"
+        if interaction.response.is_done():
+            await interaction.followup.send(message)
+        else:
+            await interaction.response.send_message(message)
@@ -0,0 +1,92 @@
+import hashlib
+import re
+import threading
+
+discord_message_limit = 2000
+max_fingerprints = 50
+max_messages_per_flush = 5
+error_header = "Usernotes script has had an exception. This can normally be ignored, " \
+               "but if it's occurring frequently, may indicate a script error."
+
+
+def fingerprint(message):
+    # ids, urls, counts and timestamps differ between repeats of the same error
+    normalized = re.sub(r"https?://\S+", "<url>", message)
+    normalized = re.sub(r"0x[0-9a-fA-F]+|\d+", "#", normalized)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class ErrorReporter:
+    # collapses repeated errors into counts, so an outage sends a bounded number of discord messages
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.errors = dict()
+        self.dropped_count = 0
+        # left over from a flush which failed part way, sent before any new errors
+        self.unsent = list()
+
+    def add(self, message):
+        key = fingerprint(message)
+        with self.lock:
+            if key in self.errors:
+                self.errors[key][0] += 1
+            elif len(self.errors) < max_fingerprints:
+                self.errors[key] = [1, message]
+            else:
+                self.dropped_count += 1
+
+    def drain(self):
+        # returns the discord messages to send, each under discord's length limit
+        with self.lock:
+            if self.unsent:
+                unsent = self.unsent
+                self.unsent = list()
+                return unsent
+            errors = list(self.errors.values())
+            dropped_count = self.dropped_count
+            self.errors = dict()
+            self.dropped_count = 0
+        if not errors and not dropped_count:
+            return list()
+
+        entries = [self.format_entry(count, message) for count, message in errors]
+        messages = list()
+        current = error_header
+        for entry in entries:
+            if len(current) + len(entry) + 1 > discord_message_limit:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{entry}" if current else entry
+        messages.append(current)
+
+        if len(messages) > max_messages_per_flush:
+            skipped = len(messages) - max_messages_per_flush
+            messages = messages[:max_messages_per_flush]
+            messages[-1] = self.append_notice(messages[-1], f"\n...and {skipped} more error messages not shown")
+        if dropped_count:
+            messages[-1] = self.append_notice(messages[-1],
+                                              f"\n...and {dropped_count} errors of other kinds not shown")
+        return messages
+
+    def requeue(self, messages):
+        # messages a flush couldn't send, retried by the next flush
+        with self.lock:
+            self.unsent = list(messages[:max_messages_per_flush])
+
+    def append_notice(self, message, notice):
+        # the body is truncated to make room, so the notice is never cut off
+        return self.fit(message, discord_message_limit - len(notice)) + notice
+
+    def format_entry(self, count, message):
+        prefix = f"**{count}x** " if count > 1 else ""
+        return self.fit(prefix + message, discord_message_limit - len(error_header) - 1)
+
+    @staticmethod
+    def fit(text, limit=discord_message_limit):
+        if len(text) <= limit:
+            return text
+        truncated = text[:limit - 20] + "\n...(truncated)"
+        # keep discord code blocks closed
+        if truncated.count("```") % 2 == 1:
+            truncated = text[:limit - 24] + "\n...(truncated)\n```"
+        return truncated
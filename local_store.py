@@ -0,0 +1,30 @@
+import sqlite3
+import threading
+
+
+class LocalStore:
+    # small on-disk store for state that should survive restarts, shared by every subreddit thread
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        print(f"Opened local store {path}")
+
+    def create_table(self, schema):
+        with self.lock:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {schema}")
+            self.connection.commit()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            cursor = self.connection.execute(sql, params)
+            self.connection.commit()
+            return cursor.rowcount
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
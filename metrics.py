@@ -0,0 +1,148 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+latency_buckets_secs = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(latency_buckets_secs)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(latency_buckets_secs):
+            if value <= bucket:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q):
+        # upper bound of the bucket containing the quantile, +Inf if beyond the largest bucket
+        target = q * self.count
+        cumulative = 0
+        for bucket, bucket_count in zip(latency_buckets_secs, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bucket
+        return float("inf")
+
+
+class MetricsRegistry:
+    # counters, gauges and latency histograms keyed by name and labels, e.g. subreddit and action
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time, **labels)
+
+    def render_prometheus(self):
+        lines = list()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(latency_buckets_secs, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bucket),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def format_stats(self, subreddit=None):
+        # human readable summary for discord, optionally only one subreddit's metrics
+        lines = list()
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if not matches_subreddit(labels, subreddit):
+                    continue
+                lines.append(f"{short_name(name)}{format_labels(labels)}: n={histogram.count} "
+                             f"avg={histogram.sum / histogram.count:.2f}s "
+                             f"p50<={histogram.quantile(0.5)}s p99<={histogram.quantile(0.99)}s")
+            for (name, labels), value in sorted(list(self.counters.items()) + list(self.gauges.items())):
+                if not matches_subreddit(labels, subreddit):
+                    continue
+                value = f"{value:.1f}" if isinstance(value, float) else value
+                lines.append(f"{short_name(name)}{format_labels(labels)}: {value}")
+        return "\n".join(lines)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def matches_subreddit(labels, subreddit):
+    label_dict = dict(labels)
+    return subreddit is None or "subreddit" not in label_dict or label_dict["subreddit"] == subreddit
+
+
+def short_name(name):
+    return name.removeprefix("usernotebot_")
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes would otherwise flood the logs
+        pass
+
+
+class IPv6MetricsServer(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+def start_metrics_server(port, host):
+    # unauthenticated, so only reachable from other machines when host is set to do so
+    server_class = IPv6MetricsServer if ":" in host else ThreadingHTTPServer
+    server = server_class((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="MetricsServer").start()
+    print(f"Serving metrics on {host}:{port} at /metrics")
+    return server
+
+
+metrics = MetricsRegistry()
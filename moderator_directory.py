@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+refresh_interval_secs = 24 * 60 * 60
+moderator_change_actions = ["addmoderator", "removemoderator", "setpermissions", "acceptmoderatorinvite"]
+
+
+class ModeratorDirectory:
+    # a subreddit's moderators by lower-cased name, shared by the comment stream and discord commands
+    def __init__(self, subreddit):
+        self.subreddit = subreddit
+        self.lock = threading.Lock()
+        self.permissions_by_mod = dict()
+        self.removal_mods = set()
+        self.full_mods = set()
+        self.last_refresh_time = 0
+        self.is_refreshing = False
+        self.refresh()
+
+    def refresh(self, subreddit=None):
+        # subreddit is the calling thread's own praw instance, fetched outside the lock so lookups carry on with
+        # the current moderators meanwhile
+        subreddit = subreddit or self.subreddit
+        permissions_by_mod = dict()
+        for moderator in subreddit.moderator():
+            permissions_by_mod[moderator.name.lower()] = set(moderator.mod_permissions)
+        with self.lock:
+            self.permissions_by_mod = permissions_by_mod
+            self.removal_mods = {name for name, permissions in permissions_by_mod.items()
+                                 if permissions & {"all", "posts"}}
+            self.full_mods = {name for name, permissions in permissions_by_mod.items()
+                              if permissions & {"all", "access"}}
+            self.last_refresh_time = time.time()
+        print(f"Refreshed {self.subreddit.display_name} removal_mods: {sorted(self.removal_mods)}")
+        print(f"Refreshed {self.subreddit.display_name} full_mods: {sorted(self.full_mods)}")
+
+    def refresh_if_stale(self):
+        # only the first caller to see it stale refreshes, the rest use the current moderators
+        with self.lock:
+            if time.time() - self.last_refresh_time < refresh_interval_secs or self.is_refreshing:
+                return
+            self.is_refreshing = True
+        try:
+            self.refresh()
+        finally:
+            with self.lock:
+                self.is_refreshing = False
+
+    def get_permissions(self, name):
+        # None if not a moderator
+        self.refresh_if_stale()
+        return self.permissions_by_mod.get(str(name).lower())
+
+    def is_removal_mod(self, name):
+        self.refresh_if_stale()
+        return name is not None and str(name).lower() in self.removal_mods
+
+    def is_full_mod(self, name):
+        self.refresh_if_stale()
+        return name is not None and str(name).lower() in self.full_mods
+
+    def handle_mod_action(self, mod_action, subreddit=None):
+        # the modlog stream replays recent actions on restart, those are already reflected
+        if mod_action.action in moderator_change_actions and mod_action.created_utc > self.last_refresh_time:
+            print(f"Moderator change in {self.subreddit.display_name}: {mod_action.action} {mod_action.target_author}")
+            self.refresh(subreddit)
@@ -0,0 +1,31 @@
+import traceback
+
+from stream_watchdog import watched_stream
+
+
+class ModlogTailer:
+    # follows a subreddit's modlog and hands every new mod action to the registered listeners
+    def __init__(self, subreddit, discord_client):
+        self.subreddit = subreddit
+        self.discord_client = discord_client
+        self.listeners = list()
+        self.start_callbacks = list()
+
+    def add_listener(self, listener, on_start=None):
+        self.listeners.append(listener)
+        if on_start:
+            self.start_callbacks.append(on_start)
+
+    def run(self):
+        # called on every (re)start, as actions may have been missed whilst stopped
+        for callback in self.start_callbacks:
+            callback()
+        for mod_action in watched_stream(self.subreddit.mod.stream.log):
+            for listener in self.listeners:
+                try:
+                    listener(mod_action)
+                except Exception as e:
+                    message = f"Exception in modlog listener for {self.subreddit.display_name} " \
+                              f"{mod_action.action}: {e}\n```{traceback.format_exc()}```"
+                    self.discord_client.send_error_msg(message)
+                    print(message)
@@ -0,0 +1,163 @@
+import itertools
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from prawcore.rate_limit import RateLimiter
+
+from metrics import metrics
+
+# reddit allows ~100 requests/minute per account, spread across every handler and discord command
+default_rate_per_sec = 1.5
+default_burst = 10
+min_rate_per_sec = 0.1
+# calls waiting on the rate limit are served in this order, so a summary PM never holds up the next removal.
+# a call waiting longer than its class's deadline is served ahead of every class, so under sustained load the
+# lower classes are delayed rather than starved
+priority_deadline_secs = {
+    "enforcement": 30,  # removals and bans
+    "usernote": 60,
+    "default": 60,  # reads, e.g. stream polls, discord lookups and the usernotes index
+    "reply": 120,  # removal reason reply, distinguish and lock
+    "notification": 300,  # PMs to mods
+    "maintenance": 600,  # usernotes compaction
+}
+priority_ranks = {priority: rank for rank, priority in enumerate(priority_deadline_secs)}
+
+Waiter = namedtuple("Waiter", ["rank", "sequence", "deadline_time"])
+
+
+class TokenBucketRateLimiter:
+    def __init__(self, rate_per_sec=default_rate_per_sec, burst=default_burst):
+        self.condition = threading.Condition()
+        self.default_rate_per_sec = rate_per_sec
+        self.rate_per_sec = rate_per_sec
+        # this process's part of the account's rate limit, less than 1 when supervised worker processes split it
+        self.share = 1
+        # no calls until then, reddit has said none are left in its window
+        self.blocked_until = 0
+        self.burst = burst
+        self.capacity = burst
+        self.tokens = burst
+        self.last_refill_time = time.time()
+        self.waiters = list()
+        self.sequence = itertools.count()
+        # priority of the reddit calls the current thread is making
+        self.local = threading.local()
+
+    def __deepcopy__(self, memo):
+        # praw deep copies listing params, and with them any Redditor's reddit instance, which paces on this
+        return self
+
+    @contextmanager
+    def prioritized(self, priority):
+        previous_priority = self.current_priority()
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous_priority
+
+    def current_priority(self):
+        return getattr(self.local, "priority", "default")
+
+    def acquire(self, tokens=1, priority="default"):
+        # blocks until tokens are available and no higher priority call is waiting, returns the seconds spent waiting
+        start_time = time.time()
+        waiter = Waiter(priority_ranks[priority], next(self.sequence), start_time + priority_deadline_secs[priority])
+        with self.condition:
+            self.waiters.append(waiter)
+            try:
+                while True:
+                    self._refill()
+                    next_waiter = self._next_waiter()
+                    blocked_secs = self.blocked_until - time.time()
+                    if next_waiter is waiter and self.tokens >= tokens and blocked_secs <= 0:
+                        self.tokens -= tokens
+                        break
+                    # the next waiter wakes when tokens are due, the rest when it has taken them or at their deadline,
+                    # when they may have become the next waiter
+                    if next_waiter is waiter:
+                        wait_secs = max((tokens - self.tokens) / self.rate_per_sec, blocked_secs)
+                    elif time.time() < waiter.deadline_time:
+                        wait_secs = waiter.deadline_time - time.time()
+                    else:
+                        wait_secs = None
+                    self.condition.wait(wait_secs)
+            finally:
+                self.waiters.remove(waiter)
+                self.condition.notify_all()
+        waited_secs = time.time() - start_time
+        if time.time() >= waiter.deadline_time:
+            metrics.increment("usernotebot_throttle_deadline_exceeded_total", priority=priority)
+        metrics.increment("usernotebot_throttle_wait_seconds_total", waited_secs)
+        metrics.increment("usernotebot_reddit_calls_total")
+        metrics.observe("usernotebot_throttle_wait_seconds", waited_secs, priority=priority)
+        return waited_secs
+
+    def _next_waiter(self):
+        # overdue waiters first, by deadline, then by priority and arrival
+        now = time.time()
+        return min(self.waiters, key=lambda waiter: (0, waiter.deadline_time, 0) if now >= waiter.deadline_time
+                   else (1, waiter.rank, waiter.sequence))
+
+    def set_share(self, share):
+        with self.condition:
+            self._refill()
+            self.rate_per_sec = self.rate_per_sec / self.share * share
+            # at least a whole token, or calls could never be made
+            self.capacity = max(self.burst * share, 1)
+            self.tokens = min(self.tokens, self.capacity)
+            self.share = share
+            metrics.set_gauge("usernotebot_rate_limit_per_sec", self.rate_per_sec)
+            self.condition.notify_all()
+
+    def update(self, remaining, seconds_to_reset):
+        # remaining is the whole account's, which other worker processes are spending too
+        with self.condition:
+            self._refill()
+            if remaining <= 0 and seconds_to_reset > 0:
+                # any call now would be rejected, so wait for the window to reset, then pace as a new window
+                if time.time() >= self.blocked_until:
+                    print(f"Reddit rate limit used up, waiting {seconds_to_reset:.0f}s for it to reset")
+                self.blocked_until = time.time() + seconds_to_reset
+                self.rate_per_sec = self.default_rate_per_sec * self.share
+            elif seconds_to_reset <= 0:
+                self.rate_per_sec = self.default_rate_per_sec * self.share
+            else:
+                # spread what reddit says is left evenly over the rest of the window
+                self.rate_per_sec = max(remaining * self.share / seconds_to_reset, min_rate_per_sec * self.share)
+            # never burst beyond what reddit has left
+            self.tokens = min(self.tokens, max(remaining * self.share, 0))
+            metrics.set_gauge("usernotebot_rate_limit_per_sec", self.rate_per_sec)
+            metrics.set_gauge("usernotebot_reddit_ratelimit_remaining", remaining)
+            self.condition.notify_all()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.rate_per_sec)
+        self.last_refill_time = now
+
+
+class SharedRateLimiter(RateLimiter):
+    # replaces prawcore's per-instance pacing, which sleeps as if each reddit instance were the account's only client
+    # and ignores priority. every request from every instance, including stream polls, waits on the shared limiter
+    def __init__(self, shared_limiter, window_size):
+        super().__init__(window_size=window_size)
+        self.shared_limiter = shared_limiter
+
+    def delay(self):
+        self.shared_limiter.acquire(priority=self.shared_limiter.current_priority())
+
+    def update(self, response_headers):
+        # X-Ratelimit-Remaining/Reset from every response. Read straight from the headers rather than prawcore's
+        # fields on this instance, as action plan steps make requests through one instance from several threads
+        if "x-ratelimit-remaining" not in response_headers:
+            return
+        self.shared_limiter.update(float(response_headers["x-ratelimit-remaining"]),
+                                   float(response_headers["x-ratelimit-reset"]))
+
+
+# shared by every RedditActionsHandler and discord command, as they all use the same reddit account
+reddit_rate_limiter = TokenBucketRateLimiter()
@@ -0,0 +1,37 @@
+import threading
+from collections import deque
+
+removal_actions = ["removecomment", "removelink"]
+max_removals_per_mod = 25
+
+
+class RecentRemovals:
+    # per-mod ring buffers of recent removals from the modlog tailer, newest first
+    def __init__(self, max_per_mod=max_removals_per_mod):
+        self.max_per_mod = max_per_mod
+        self.lock = threading.Lock()
+        self.removals_by_mod = dict()
+
+    def reset(self):
+        # a restarted tailer may have missed actions, so buffered removals are no longer contiguous
+        with self.lock:
+            self.removals_by_mod = dict()
+
+    def handle_mod_action(self, mod_action):
+        if mod_action.action not in removal_actions:
+            return
+        with self.lock:
+            removals = self.removals_by_mod.setdefault(str(mod_action.mod).lower(), deque(maxlen=self.max_per_mod))
+            # the modlog stream replays recent actions when it restarts
+            if removals and (mod_action.created_utc < removals[0].created_utc or
+                             any(removal.id == mod_action.id for removal in removals)):
+                return
+            removals.appendleft(mod_action)
+
+    def get_removals(self, mod, count):
+        # None if fewer than count removals are buffered, as older ones may exist in the modlog
+        with self.lock:
+            removals = self.removals_by_mod.get(mod.lower(), deque())
+            if len(removals) < count:
+                return None
+            return list(removals)[:count]
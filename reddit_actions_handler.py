@@ -1,94 +1,267 @@
 import time
 import traceback
+from collections import namedtuple
 
 import pmtw
 from pmtw import ToolboxNote
 from praw.exceptions import RedditAPIException
+from prawcore import NotFound
 
-from settings import Settings
+from action_journal import ActionJournal
+from action_plan import ActionPlan
+from ban_history import BanHistory
+from circuit_breaker import Backoff, circuit_breakers, transient_errors
+from metrics import metrics
+from rate_limiter import reddit_rate_limiter
+from recent_removals import RecentRemovals, removal_actions
+from removal_reasons import RemovalReasons
+from settings import Settings, SettingsFactory
+from summary_digest import SummaryDigest, summary_header
+from usernote_utils import find_ban, get_id
+from usernote_writer import UsernoteWriteBuffer
+from usernotes_compactor import UsernotesCompactor
+from usernotes_index import UsernotesIndex
+
+# plain values for discord, so they can be sent from a supervised worker process
+UsernoteSummary = namedtuple("UsernoteSummary", ["human_time", "mod", "warning", "note"])
+ModRemoval = namedtuple("ModRemoval", ["action", "mod", "target_author", "target_permalink", "target_body",
+                                       "target_title", "target_fullname"])
 
 
 class RedditActionsHandler:
     max_retries = 3
-    retry_delay_secs = 10
+    retry_base_delay_secs = 5
+    retry_max_delay_secs = 60
 
-    def __init__(self, reddit, subreddit, discord_client):
+    def __init__(self, reddit, subreddit, discord_client, local_store, moderators):
         self.reddit = reddit
         self.subreddit = subreddit
+        self.subreddit_name = subreddit.display_name
+        self.circuit = circuit_breakers.get(subreddit.display_name)
         self.toolbox = pmtw.Toolbox(
             subreddit
         )
         self.discord_client = discord_client
-        self.last_call_time = 0
+        self.local_store = local_store
+        self.moderators = moderators
+        self.settings = SettingsFactory.get_settings(subreddit.display_name)
+        self.removal_reasons = RemovalReasons(self, self.settings)
+        self.ban_history = BanHistory(local_store, subreddit.display_name)
+        self.journal = ActionJournal(local_store, subreddit.display_name)
+        self.recent_removals = RecentRemovals()
+        self.usernotes_index = UsernotesIndex(self)
+        self.usernote_writer = UsernoteWriteBuffer(self)
+        self.usernotes_compactor = UsernotesCompactor(self)
+        # set once the subreddit is removed whilst running, its queued mod commands are then left pending
+        self.is_closed = False
+        # started by the bot, not e.g. the compaction script sharing its local store
+        self.summary_digest = None
+
+    def start_summary_digest(self):
+        if self.settings.summary_digest_interval_secs > 0:
+            self.summary_digest = SummaryDigest(self, self.local_store, self.settings.summary_digest_interval_secs,
+                                                self.settings.summary_digest_max_actions)
+        else:
+            # summaries buffered before a restart with digests turned off are sent straight away
+            SummaryDigest(self, self.local_store, 0, 0).stop()
 
     def write_usernote(self, url, user, note_type, detail):
         print(f"Writing usernote for {str(user)}: {detail}")
 
+        start_time = time.time()
         redditor = self.reddit.redditor(user)
-        note = ToolboxNote(redditor, detail, warning=note_type, url=url)
-        self.reddit_call(lambda: self.toolbox.usernotes.add(note))
+        # pmtw fills in the mod when saving, the index is given the note as written so needs it up front
+        note = ToolboxNote(redditor, detail, warning=note_type, url=url, mod=self.reddit.user.me().name)
+        # writes are coalesced, wait on the returned future to know the note has been saved
+        future = self.usernote_writer.add(note)
+        future.add_done_callback(lambda _: self.observe_action("write_usernote", time.time() - start_time))
+        return future
 
-    def write_removal_reason(self, content, cited_rules):
+    def plan_removal_reason(self, plan, content, cited_rules):
+        # the reply must exist before it can be distinguished and locked, the rest of the plan doesn't wait on it
         print(f"Writing removal comment for {str(content)}: {str(cited_rules)}")
 
-        reddit_rule_message = ""
-        sub_rules = list(self.subreddit.rules)
-        for cited_rule in cited_rules:
-            # ignore rules that aren't included in the sub set
-            if cited_rule > len(sub_rules):
-                continue
-            rule_detail = sub_rules[cited_rule - 1]
-            rule_message = f"Rule {rule_detail.priority + 1}: {rule_detail.short_name}\n\n" \
-                           f"{rule_detail.description}\n\n"
-            reddit_rule_message = reddit_rule_message + rule_message
-
-        response = f"Hi, thanks for contributing. " \
-                   f"However, your submission was removed from r/{self.subreddit.display_name}.\n\n" \
-                   f"{reddit_rule_message}" \
-                   f"You can message the mods if you feel this was in error," \
-                   f" please include a link to the comment or post in question."
-        comment = self.reddit_call(lambda: content.reply(response))
-        self.reddit_call(lambda: comment.mod.distinguish(sticky=True), reddit_throttle_secs=1)
-        self.reddit_call(lambda: comment.mod.lock(), reddit_throttle_secs=1)
+        def reply():
+            with self.timed_action("write_removal_reason"):
+                response = self.removal_reasons.build_message(cited_rules)
+                return self.reddit_call(lambda: content.reply(response), "reply")
+
+        def distinguish():
+            with self.timed_action("distinguish_removal_reason"):
+                comment = plan.results["removal_reason"]
+                self.reddit_call(lambda: comment.mod.distinguish(sticky=True), "reply")
+
+        def lock():
+            with self.timed_action("lock_removal_reason"):
+                comment = plan.results["removal_reason"]
+                self.reddit_call(lambda: comment.mod.lock(), "reply")
+
+        plan.add("removal_reason", reply, restore=lambda fullname: self.reddit.comment(fullname.split("_", 1)[1]))
+        plan.add("distinguish_removal_reason", distinguish, depends_on=["removal_reason"])
+        plan.add("lock_removal_reason", lock, depends_on=["removal_reason"])
 
     def remove_content(self, removal_reason, content):
         print(f"Removing content, reason: {removal_reason}")
-        self.reddit_call(lambda: content.mod.remove(mod_note=removal_reason))
+        with self.timed_action("remove_content"):
+            self.reddit_call(lambda: content.mod.remove(mod_note=removal_reason), "enforcement")
 
     def send_message(self, user, subject, detail):
         print(f"Send message to {user}, detail: {detail}")
-        self.reddit_call(lambda: user.message(subject, detail))
+        with self.timed_action("send_message"):
+            self.reddit_call(lambda: user.message(subject, detail), "notification")
+
+    def send_summary(self, user, summary):
+        if self.summary_digest:
+            print(f"Adding to {user}'s summary digest: {summary}")
+            self.summary_digest.add(user.name, summary)
+        else:
+            self.send_message(user, "Bot Action Summary", summary_header + summary)
 
     def ban_user(self, user, external_detail, internal_detail, duration):
         print(f"Banning {user} for {duration}, detail: {internal_detail}")
         internal_detail = (internal_detail[:97] + '...') if len(internal_detail) > 100 else internal_detail
-        if duration.isnumeric():
-            self.reddit_call(lambda: self.subreddit.banned.add(user, ban_message=external_detail,
-                                                               ban_reason=internal_detail, duration=int(duration)))
+        with self.timed_action("ban_user"):
+            if duration.isnumeric():
+                self.reddit_call(lambda: self.subreddit.banned.add(user, ban_message=external_detail,
+                                                                   ban_reason=internal_detail,
+                                                                   duration=int(duration)), "enforcement")
+            else:
+                self.reddit_call(lambda: self.subreddit.banned.add(user, ban_message=external_detail,
+                                                                   ban_reason=internal_detail), "enforcement")
+
+    # discord commands only use the methods below, which a supervised worker process also serves over its pipe
+
+    def get_mod_permissions(self, mod):
+        return self.moderators.get_permissions(mod)
+
+    def redditor_exists(self, username):
+        try:
+            self.reddit_read(lambda: self.reddit.redditor(username).id)
+            return True
+        except NotFound:
+            return False
+
+    def get_usernotes(self, username):
+        return [UsernoteSummary(note.human_time, note.mod, note.warning, note.note)
+                for note in self.usernotes_index.get_notes(username)]
+
+    def get_recent_removals(self, mod, count):
+        # served from the modlog tailer's buffer, only search the modlog if it doesn't have enough
+        mod_removals = self.recent_removals.get_removals(mod, count)
+        if mod_removals is None:
+            mod_removals = self.reddit_read(lambda: self.find_mod_removals(mod, count))
+        return [ModRemoval(mod_action.action, mod_action.mod, mod_action.target_author,
+                           mod_action.target_permalink, mod_action.target_body, mod_action.target_title,
+                           mod_action.target_fullname) for mod_action in mod_removals]
+
+    def find_mod_removals(self, mod, count):
+        mod_removals = list()
+        for mod_action in self.subreddit.mod.log(mod=mod):
+            if mod_action.action in removal_actions:
+                mod_removals.append(mod_action)
+            if len(mod_removals) >= count:
+                break
+        return mod_removals
+
+    def refresh_rules(self):
+        self.removal_reasons.invalidate()
+
+    def apply_settings(self, settings):
+        # settings changed whilst running, e.g. in the subreddits file. Rules are fetched again on the next removal
+        self.settings = settings
+        self.removal_reasons = RemovalReasons(self, settings)
+        if settings.summary_digest_interval_secs <= 0:
+            if self.summary_digest:
+                self.summary_digest.stop()
+                self.summary_digest = None
+        elif self.summary_digest:
+            self.summary_digest.interval_secs = settings.summary_digest_interval_secs
+            self.summary_digest.max_actions = settings.summary_digest_max_actions
         else:
-            self.reddit_call(lambda: self.subreddit.banned.add(user, ban_message=external_detail,
-                                                               ban_reason=internal_detail))
+            self.summary_digest = SummaryDigest(self, self.local_store, settings.summary_digest_interval_secs,
+                                                settings.summary_digest_max_actions)
+
+    def close(self):
+        # the subreddit was removed whilst running, what's buffered is still written. The moderator directory and
+        # usernotes index have no threads of their own, they go with this handler
+        self.is_closed = True
+        self.usernote_writer.close()
+        if self.summary_digest:
+            self.summary_digest.close()
+        # a fresh circuit if the subreddit is added again, its stream threads have already been stopped
+        circuit_breakers.remove(self.subreddit_name)
+
+    def find_ban_type(self, target_user, ban_command):
+        return find_ban(self.discord_client, self.subreddit, self.reddit.redditor(target_user), ban_command,
+                        self.ban_history)
+
+    def compact_usernotes(self, archive_age_days, check_accounts):
+        if archive_age_days is None:
+            archive_age_days = self.settings.usernotes_archive_age_days
+        return self.usernotes_compactor.compact(archive_age_days, check_accounts)
+
+    def take_usernote_actions(self, mod, url, target_user, full_note, rules_str, content_fullname, is_comment,
+                              should_comment, cited_rules, ban_type):
+        plan = ActionPlan(f"{self.subreddit_name} usernote modal for {target_user}")
+        plan.add("usernote", lambda: self.write_usernote(url, target_user, None, full_note).result())
+        if should_comment:
+            content_id = get_id(content_fullname)
+            content = self.reddit.comment(content_id) if is_comment else self.reddit.submission(content_id)
+            self.plan_removal_reason(plan, content, cited_rules)
+        if ban_type:
+            internal_detail = f"Usernotes command by {mod} for {full_note}"
+            plan.add("ban", lambda: self.ban_user(target_user, rules_str, internal_detail, ban_type))
+        plan.execute()
+
+    def timed_action(self, action):
+        return metrics.timer("usernotebot_action_seconds", subreddit=self.subreddit.display_name, action=action)
 
-    def reddit_call(self, callback, reddit_throttle_secs=5):
+    def observe_action(self, action, seconds):
+        metrics.observe("usernotebot_action_seconds", seconds, subreddit=self.subreddit.display_name, action=action)
+
+    def reddit_read(self, callback, priority="default", wait=False):
+        # reads aren't affected by dry run, but share the rate budget with actions.
+        # discord reads fail straight away whilst reddit is failing, reads a write depends on wait like reddit_call
+        self.circuit.before_call(wait=wait)
+        try:
+            with reddit_rate_limiter.prioritized(priority):
+                result = callback()
+        except Exception as e:
+            self.circuit.record(e)
+            raise e
+        self.circuit.record_success()
+        return result
+
+    def reddit_call(self, callback, priority="default"):
+        # priority is a rate_limiter.priority_deadline_secs class, deciding which waiting call goes first
         if Settings.is_dry_run:
             print("\tDRY RUN!!!")
             return
-        # throttle reddit calls to prevent reddit throttling
-        elapsed_time = time.time() - self.last_call_time
-        if elapsed_time < reddit_throttle_secs:
-            time.sleep(reddit_throttle_secs - elapsed_time)
         # retry reddit exceptions, such as throttling or reddit issues
+        backoff = Backoff(self.retry_base_delay_secs, self.retry_max_delay_secs)
         for i in range(self.max_retries):
+            # whilst reddit is failing, waits for the circuit to let a probe through rather than adding to it
+            self.circuit.before_call()
             try:
-                result = callback()
-                self.last_call_time = time.time()
-                return result
-            except RedditAPIException as e:
+                # each request waits on the limiter shared across all handlers, to prevent reddit throttling
+                with reddit_rate_limiter.prioritized(priority):
+                    result = callback()
+            except (RedditAPIException, *transient_errors) as e:
+                self.circuit.record(e)
+                metrics.increment("usernotebot_reddit_retries_total", subreddit=self.subreddit.display_name)
                 message = f"Exception in RedditRetry: {e}\n```{traceback.format_exc()}```"
                 self.discord_client.send_error_msg(message)
                 print(message)
                 if i < self.max_retries - 1:
-                    print(f"Retrying in {self.retry_delay_secs} seconds...")
-                    time.sleep(self.retry_delay_secs)
+                    retry_delay_secs = backoff.next_delay()
+                    print(f"Retrying in {retry_delay_secs:.0f} seconds...")
+                    time.sleep(retry_delay_secs)
                 else:
                     raise e
+            except Exception as e:
+                # reddit responded, e.g. the content was deleted, so not worth retrying
+                self.circuit.record(e)
+                raise e
+            else:
+                self.circuit.record_success()
+                return result
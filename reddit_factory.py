@@ -0,0 +1,127 @@
+import threading
+
+import praw
+import requests
+from prawcore import Requestor, ScriptAuthorizer
+from prawcore.auth import BaseAuthorizer
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from rate_limiter import SharedRateLimiter, reddit_rate_limiter
+
+default_pool_size = 10
+# oauth.reddit.com for api calls and www.reddit.com for tokens
+pool_hosts = 2
+
+
+class SharedScriptAuthorizer(ScriptAuthorizer):
+    # one OAuth token for every reddit instance, refreshed by whichever thread first finds it expired
+    def __init__(self, authenticator, username, password):
+        super().__init__(authenticator, username, password)
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # praw deep copies listing params, which copies any Redditor in them along with its reddit instance.
+        # the copy shares the token, as every other instance does
+        return self
+
+    def refresh(self):
+        with self.lock:
+            # another thread may have refreshed it while this one waited
+            if self.is_valid():
+                return
+            super().refresh()
+        metrics.increment("usernotebot_reddit_token_refreshes_total")
+
+
+class InstanceAuthorizer(BaseAuthorizer):
+    # prawcore sends an instance's requests through its authorizer's requestor, so each instance keeps its own
+    # authorizer, and with it its own user agent, whilst the token is the account's SharedScriptAuthorizer
+    def __init__(self, authenticator, shared_authorizer):
+        # BaseAuthorizer's constructor would clear the shared token
+        self._authenticator = authenticator
+        self.shared_authorizer = shared_authorizer
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def access_token(self):
+        return self.shared_authorizer.access_token
+
+    @property
+    def scopes(self):
+        return self.shared_authorizer.scopes
+
+    def is_valid(self):
+        return self.shared_authorizer.is_valid()
+
+    def refresh(self):
+        self.shared_authorizer.refresh()
+
+    def revoke(self):
+        self.shared_authorizer.revoke()
+
+    def _clear_access_token(self):
+        self.shared_authorizer._clear_access_token()
+
+
+class UserAgentRequestor(Requestor):
+    # prawcore sets the user agent on the http session, which is shared, so it would send whichever instance was
+    # created last. Each instance's own user agent goes on every one of its requests instead
+    def __init__(self, user_agent, *args, **kwargs):
+        super().__init__(user_agent, *args, **kwargs)
+        self.user_agent = self._http.headers["User-Agent"]
+
+    def request(self, *args, headers=None, **kwargs):
+        return super().request(*args, headers={**(headers or dict()), "User-Agent": self.user_agent}, **kwargs)
+
+
+class RedditClientFactory:
+    # each stream thread gets its own praw.Reddit, but they share one token and one keep-alive connection pool
+    # rather than each fetching a token and opening its own connections. With the token and the pacing shared and
+    # locked, an instance keeps no per-request state of its own, so action plan steps can make concurrent requests
+    # through their handler's instance
+    def __init__(self, pool_size=default_pool_size):
+        self.lock = threading.Lock()
+        self.http_session = None
+        self.authorizers = dict()
+        self.configure(pool_size)
+
+    def configure(self, pool_size):
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+        with self.lock:
+            self.http_session = http_session
+
+    def create(self, bot_password, bot_username, client_id, client_secret, user_agent_suffix):
+        reddit = praw.Reddit(
+            client_id=client_id, client_secret=client_secret,
+            user_agent=f"flyio:com.usernotebot.{user_agent_suffix}",
+            redirect_uri="http://localhost:8080",  # unused for script applications
+            username=bot_username, password=bot_password,
+            check_for_async=False,
+            # praw otherwise asks PyPI for a newer version on every start
+            check_for_updates=False,
+            requestor_class=UserAgentRequestor,
+            requestor_kwargs={"session": self.http_session}
+        )
+        authenticator = reddit._core._authorizer._authenticator
+        reddit._core._authorizer = InstanceAuthorizer(authenticator, self.get_authorizer(authenticator, bot_username,
+                                                                                         bot_password, client_id))
+        # paced by the shared, priority aware limiter rather than each instance on its own. _rate_limiter is
+        # private to prawcore's Session as of prawcore 2.4.0, pinned in requirements.txt
+        reddit._core._rate_limiter = SharedRateLimiter(reddit_rate_limiter, reddit._core._rate_limiter.window_size)
+        return reddit
+
+    def get_authorizer(self, authenticator, bot_username, bot_password, client_id):
+        with self.lock:
+            key = (client_id, bot_username)
+            if key not in self.authorizers:
+                self.authorizers[key] = SharedScriptAuthorizer(authenticator, bot_username, bot_password)
+            return self.authorizers[key]
+
+
+reddit_client_factory = RedditClientFactory()
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from praw.models.reddit.rules import SubredditRules
+
+rules_placeholder = "\0rules\0"
+
+
+class RemovalReasons:
+    # caches subreddit rules and pre-renders each rule's removal text, so a removal comment is a join
+    def __init__(self, reddit_handler, settings):
+        self.reddit_handler = reddit_handler
+        self.subreddit = reddit_handler.subreddit
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.rule_messages = list()
+        self.rules_fetched_time = 0
+
+        # the subreddit never changes, so only the cited rules are filled in per removal
+        message = settings.removal_message_template.format(subreddit=self.subreddit.display_name,
+                                                           rules=rules_placeholder)
+        self.message_prefix, self.message_suffix = message.split(rules_placeholder, 1)
+
+    def build_message(self, cited_rules):
+        rule_messages = self.get_rule_messages()
+        # ignore rules that aren't included in the sub set
+        cited_messages = [rule_messages[cited_rule - 1] for cited_rule in cited_rules
+                          if 0 < cited_rule <= len(rule_messages)]
+        return self.message_prefix + "".join(cited_messages) + self.message_suffix
+
+    def get_rule_messages(self):
+        with self.lock:
+            if time.time() - self.rules_fetched_time < self.settings.rules_cache_ttl_secs:
+                return self.rule_messages
+        # subreddit.rules caches its first fetch for the life of the subreddit, so fetch through a new instance
+        sub_rules = self.reddit_handler.reddit_read(lambda: list(SubredditRules(self.subreddit)), wait=True)
+        rule_messages = [self.settings.removal_rule_template.format(number=rule.priority + 1,
+                                                                    short_name=rule.short_name,
+                                                                    description=rule.description)
+                         for rule in sub_rules]
+        with self.lock:
+            self.rule_messages = rule_messages
+            self.rules_fetched_time = time.time()
+        print(f"Refreshed {len(rule_messages)} rules for {self.subreddit.display_name}")
+        return rule_messages
+
+    def invalidate(self):
+        with self.lock:
+            self.rules_fetched_time = 0
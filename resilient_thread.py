@@ -1,37 +1,117 @@
 import threading
-import traceback
 import time
+import traceback
+from contextlib import contextmanager
+
+from circuit_breaker import Backoff
 
-retry_wait_time_secs = 30
+retry_base_delay_secs = 5
+retry_max_delay_secs = 5 * 60
+# a run lasting this long counts as recovered, so the next failure backs off from the start again
+healthy_run_secs = 60
+# a thread stopped whilst stuck, e.g. on a hung read, is left to finish on its own
+restart_join_timeout_secs = 30
 
 
 class ResilientThread(threading.Thread):
-    def __init__(self, discord_client, name, target=None, args=()):
+    def __init__(self, discord_client, name, target=None, args=(), circuit_breaker=None):
         super(ResilientThread, self).__init__()
         self.stop_event = threading.Event()
         self.discord_client = discord_client
         self.name = name
         self.target = target
         self.args = args
+        # shared with the subreddit's other reddit calls, if given
+        self.circuit_breaker = circuit_breaker
+        self.backoff = Backoff(retry_base_delay_secs, retry_max_delay_secs)
+        # only while running the target, a thread backing off or waiting on its circuit isn't stalled
+        self.is_running_target = False
+        self.last_progress_time = time.time()
+        # only progress the target reported, rather than it being (re)started
+        self.reported_progress_time = None
+        # whilst the target waits on something other than reddit, e.g. a full action queue, which isn't a stall
+        self.is_waiting = False
 
     def run(self):
-        while not self.stop_event.wait(30):
+        # the first run starts straight away, so streams are read as soon as the bot starts
+        while not self.stop_event.is_set():
+            # whilst reddit is failing, only restart when the circuit lets a probe through
+            if self.circuit_breaker and not self.circuit_breaker.before_call(stop_event=self.stop_event):
+                break
+            healthy_timer = threading.Timer(healthy_run_secs, self.mark_healthy)
+            healthy_timer.daemon = True
+            healthy_timer.start()
+            self.last_progress_time = time.time()
+            self.is_running_target = True
             try:
                 if self.target:
                     self.target(*self.args)
+                healthy_timer.cancel()
+                retry_delay_secs = self.backoff.next_delay()
             except Exception as e:
-                message = f"Exception in ResilientThread {self.name}: {e}\n```{traceback.format_exc()}```"
+                healthy_timer.cancel()
+                # e.g. a stuck read finally failing after the watchdog replaced this thread
+                if self.stop_event.is_set():
+                    break
+                if self.circuit_breaker:
+                    self.circuit_breaker.record(e)
+                retry_delay_secs = self.backoff.next_delay()
+                message = f"Exception in ResilientThread {self.name}, restarting in {retry_delay_secs:.0f}s: {e}\n" \
+                          f"```{traceback.format_exc()}```"
                 self.discord_client.send_error_msg(message)
                 print(message)
-                time.sleep(retry_wait_time_secs)
+            finally:
+                self.is_running_target = False
+            self.stop_event.wait(retry_delay_secs)
+
+    def mark_healthy(self):
+        self.backoff.reset()
+        # for targets which don't report progress
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
 
     def stop(self):
         self.stop_event.set()
 
+    def report_progress(self):
+        # called by the target whenever it makes progress. False once the thread has been stopped, e.g. replaced
+        # by the watchdog, so the target returns rather than running alongside its replacement
+        self.last_progress_time = time.time()
+        self.reported_progress_time = self.last_progress_time
+        # a read worked, so if this run was the circuit's probe, the subreddit's other calls carry on straight away
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+        return not self.stop_event.is_set()
+
     def restart(self):
+        # returns the new thread, which replaces this one
         print(f"Restarting ResilientThread {self.name}...")
         self.stop()
-        if self.is_alive():
-            self.join()
-        new_thread = ResilientThread(self.discord_client, self.name, self.target, self.args)
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(restart_join_timeout_secs)
+            if self.is_alive():
+                print(f"ResilientThread {self.name} is stuck, starting its replacement anyway")
+        new_thread = ResilientThread(self.discord_client, self.name, self.target, self.args, self.circuit_breaker)
         new_thread.start()
+        return new_thread
+
+
+@contextmanager
+def stall_clock_paused():
+    # around a wait the watchdog shouldn't restart the thread for, the clock starts again from when it ends
+    thread = threading.current_thread()
+    if not isinstance(thread, ResilientThread):
+        yield
+        return
+    thread.is_waiting = True
+    try:
+        yield
+    finally:
+        thread.last_progress_time = time.time()
+        thread.is_waiting = False
+
+
+def report_progress():
+    # for targets which may also run outside a ResilientThread, e.g. in the benchmark
+    thread = threading.current_thread()
+    return thread.report_progress() if isinstance(thread, ResilientThread) else True
@@ -5,6 +5,21 @@ class Settings:
     # set to True to prevent any bot actions (report, remove, comments)
     is_dry_run = False
     guild_name = None
+    # subreddit rules are cached for removal comments, use .refresh_rules on discord after editing them
+    rules_cache_ttl_secs = 6 * 60 * 60
+    # {subreddit} is the subreddit name, {rules} is every cited rule rendered with removal_rule_template
+    removal_message_template = "Hi, thanks for contributing. " \
+                               "However, your submission was removed from r/{subreddit}.\n\n" \
+                               "{rules}" \
+                               "You can message the mods if you feel this was in error," \
+                               " please include a link to the comment or post in question."
+    removal_rule_template = "Rule {number}: {short_name}\n\n{description}\n\n"
+    # when above 0, each mod's "Bot Action Summary" PMs are buffered and sent as one PM once the oldest has waited
+    # this long, or summary_digest_max_actions have built up. Error PMs are always sent straight away
+    summary_digest_interval_secs = 0
+    summary_digest_max_actions = 10
+    # .compact_usernotes moves notes older than this to the usernotes_archive wiki page
+    usernotes_archive_age_days = 2 * 365
 
 
 class CollapseSettings(Settings):
@@ -20,6 +35,8 @@ class SettingsFactory:
         'collapse': CollapseSettings,
         'ufos': UFOsSettings,
     }
+    # per subreddit, from the subreddits file or discord, applied over the subreddit's settings class
+    overrides = dict()
 
     @staticmethod
     def get_settings(subreddit_name):
@@ -28,4 +45,32 @@ class SettingsFactory:
             raise ValueError("subreddit_name contains invalid characters")
 
         settings_class = SettingsFactory.settings_classes.get(subreddit_name.lower(), Settings)
-        return settings_class()
+        settings = settings_class()
+        for setting, value in SettingsFactory.overrides.get(subreddit_name.lower(), dict()).items():
+            setattr(settings, setting, value)
+        return settings
+
+    @staticmethod
+    def set_overrides(subreddit_name, overrides):
+        SettingsFactory.validate_overrides(subreddit_name, overrides)
+        SettingsFactory.overrides[subreddit_name.lower()] = dict(overrides)
+
+    @staticmethod
+    def remove_overrides(subreddit_name):
+        SettingsFactory.overrides.pop(subreddit_name.lower(), None)
+
+    @staticmethod
+    def validate_overrides(subreddit_name, overrides):
+        if not re.match(r'^\w+$', subreddit_name):
+            raise ValueError(f"subreddit name {subreddit_name} contains invalid characters")
+        if not isinstance(overrides, dict):
+            raise ValueError(f"settings for {subreddit_name} should map setting names to values")
+        for setting, value in overrides.items():
+            # is_dry_run applies to the whole bot, use .set_dry_run
+            if setting.startswith("_") or setting == "is_dry_run" or not hasattr(Settings, setting):
+                raise ValueError(f"unknown setting {setting} for {subreddit_name}")
+            default = getattr(Settings, setting)
+            expected_type = str if default is None else type(default)
+            if not isinstance(value, expected_type):
+                raise ValueError(f"setting {setting} for {subreddit_name} should be {expected_type.__name__}, "
+                                 f"not {value!r}")
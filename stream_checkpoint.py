@@ -0,0 +1,88 @@
+import threading
+import time
+
+# the position is saved at most this often, mod commands always save it
+checkpoint_interval_secs = 5
+# handled commands are remembered for this long, well past the ~100 comments a stream replays, which the
+# position already skips
+processed_command_retention_secs = 7 * 24 * 60 * 60
+processed_command_prune_interval_secs = 60 * 60
+
+
+class StreamCheckpoint:
+    # last comment seen on a subreddit's stream, and which mod commands have been handled,
+    # so the ~100 comments replayed on every stream (re)start are skipped without reddit calls
+    def __init__(self, local_store, subreddit_name):
+        self.local_store = local_store
+        self.subreddit_name = subreddit_name.lower()
+        self.lock = threading.Lock()
+        local_store.create_table("stream_checkpoints (subreddit TEXT PRIMARY KEY, last_fullname TEXT, "
+                                 "updated_utc REAL)")
+        local_store.create_table("processed_commands (subreddit TEXT, comment_id TEXT, status TEXT, "
+                                 "updated_utc REAL, PRIMARY KEY (subreddit, comment_id))")
+        row = local_store.query_one("SELECT last_fullname FROM stream_checkpoints WHERE subreddit = ?",
+                                    (self.subreddit_name,))
+        self.last_fullname = row[0] if row else None
+        self.last_saved_time = 0
+        # commands queued by this process, which a replay mustn't queue again
+        self.in_flight = set()
+        self.last_pruned_time = 0
+        self.prune_processed_commands()
+        print(f"Loaded stream checkpoint for {self.subreddit_name}: {self.last_fullname}")
+
+    def is_seen(self, comment):
+        # reddit ids are base36 and increase over time
+        with self.lock:
+            return self.last_fullname is not None and \
+                int(comment.id, 36) <= int(self.last_fullname.split("_")[1], 36)
+
+    def mark_seen(self, comment, force_save=False):
+        with self.lock:
+            if self.is_newer(comment):
+                self.last_fullname = comment.fullname
+            if not force_save and time.time() - self.last_saved_time < checkpoint_interval_secs:
+                return
+            self.last_saved_time = time.time()
+            last_fullname = self.last_fullname
+        self.local_store.execute("INSERT OR REPLACE INTO stream_checkpoints VALUES (?, ?, ?)",
+                                 (self.subreddit_name, last_fullname, time.time()))
+
+    def is_newer(self, comment):
+        return self.last_fullname is None or int(comment.id, 36) > int(self.last_fullname.split("_")[1], 36)
+
+    def is_unfinished(self, comment_id):
+        # queued by an earlier run which stopped before actioning it
+        with self.lock:
+            if comment_id in self.in_flight:
+                return False
+        return self.get_command_status(comment_id) == "pending"
+
+    def get_unfinished_commands(self):
+        rows = self.local_store.query("SELECT comment_id FROM processed_commands WHERE subreddit = ? "
+                                      "AND status = 'pending' ORDER BY updated_utc", (self.subreddit_name,))
+        return [row[0] for row in rows]
+
+    def get_command_status(self, comment_id):
+        row = self.local_store.query_one("SELECT status FROM processed_commands WHERE subreddit = ? "
+                                         "AND comment_id = ?", (self.subreddit_name, comment_id))
+        return row[0] if row else None
+
+    def mark_command(self, comment_id, status):
+        with self.lock:
+            if status == "pending":
+                self.in_flight.add(comment_id)
+            else:
+                self.in_flight.discard(comment_id)
+        self.local_store.execute("INSERT OR REPLACE INTO processed_commands VALUES (?, ?, ?, ?)",
+                                 (self.subreddit_name, comment_id, status, time.time()))
+        if status == "done" and time.time() - self.last_pruned_time >= processed_command_prune_interval_secs:
+            self.prune_processed_commands()
+
+    def prune_processed_commands(self):
+        # pending commands are kept until they're resumed
+        self.last_pruned_time = time.time()
+        pruned = self.local_store.execute("DELETE FROM processed_commands WHERE subreddit = ? AND status = 'done' "
+                                          "AND updated_utc < ?",
+                                          (self.subreddit_name, time.time() - processed_command_retention_secs))
+        if pruned:
+            print(f"Pruned {pruned} handled commands for {self.subreddit_name}")
@@ -0,0 +1,115 @@
+import threading
+import time
+import traceback
+
+from praw.models.util import ExponentialCounter
+
+from metrics import metrics
+from resilient_thread import report_progress
+
+# streams poll at least every ~16s and report each poll, even without new items, so a stream this long without
+# progress is stuck, e.g. on a hung read
+stall_threshold_secs = 5 * 60
+check_interval_secs = 30
+# as praw's streams back off when there's nothing new
+max_idle_poll_secs = 16
+
+
+def watched_stream(stream_function):
+    # a praw stream, e.g. subreddit.stream.comments, reporting progress after every poll rather than only when
+    # there's something new. Ends once the thread has been stopped, e.g. replaced by the watchdog
+    idle_counter = ExponentialCounter(max_counter=max_idle_poll_secs)
+    # None after each poll without new items, praw then leaves the backing off to us
+    for item in stream_function(pause_after=0):
+        if not report_progress():
+            return
+        if item is None:
+            time.sleep(idle_counter.counter())
+            continue
+        idle_counter.reset()
+        yield item
+
+
+class WatchedStream:
+    def __init__(self, thread):
+        self.thread = thread
+        # last progress before a stall, until the restarted thread makes progress
+        self.stalled_since = None
+        self.restart_time = None
+
+
+class StreamWatchdog:
+    # restarts stream threads which stop making progress whilst running, a ResilientThread only restarts its
+    # target once it raises, which a stuck read never does
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = dict()
+        self.thread = None
+
+    def watch(self, thread):
+        with self.lock:
+            self.streams[thread.name] = WatchedStream(thread)
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="StreamWatchdog")
+                self.thread.start()
+
+    def stop(self, name):
+        # stops the stream's current thread and stops watching it, e.g. when its subreddit is removed
+        with self.lock:
+            stream = self.streams.pop(name, None)
+        if stream:
+            stream.thread.stop()
+
+    def get_thread(self, name):
+        # the current thread for a stream, after any restarts
+        with self.lock:
+            stream = self.streams.get(name)
+            return stream.thread if stream else None
+
+    def run(self):
+        while True:
+            time.sleep(check_interval_secs)
+            try:
+                self.check()
+            except Exception as e:
+                message = f"Exception in stream watchdog: {e}\n```{traceback.format_exc()}```"
+                print(message)
+
+    def check(self):
+        with self.lock:
+            streams = list(self.streams.items())
+        for name, stream in streams:
+            thread = stream.thread
+            if stream.stalled_since is not None and thread.reported_progress_time and \
+                    thread.reported_progress_time > stream.restart_time:
+                recover_secs = thread.reported_progress_time - stream.stalled_since
+                print(f"Stream {name} recovered after {recover_secs:.0f}s")
+                metrics.observe("usernotebot_stream_recovery_seconds", recover_secs, stream=name)
+                stream.stalled_since = None
+
+            is_stalling = thread.is_running_target and not thread.is_waiting
+            stall_secs = time.time() - thread.last_progress_time if is_stalling else 0
+            metrics.set_gauge("usernotebot_stream_stall_seconds", stall_secs, stream=name)
+            if stall_secs >= stall_threshold_secs:
+                self.restart(name, stream, stall_secs)
+
+    def restart(self, name, stream, stall_secs):
+        message = f"Stream {name} made no progress for {stall_secs:.0f}s, restarting it"
+        thread = stream.thread
+        thread.discord_client.send_error_msg(message)
+        print(message)
+        metrics.increment("usernotebot_stream_stall_restarts_total", stream=name)
+        if stream.stalled_since is None:
+            stream.stalled_since = thread.last_progress_time
+        stream.restart_time = time.time()
+        new_thread = thread.restart()
+        with self.lock:
+            stream.thread = new_thread
+            is_stopped = self.streams.get(name) is not stream
+        # stopped whilst restarting
+        if is_stopped:
+            new_thread.stop()
+
+
+# one watchdog for every stream in the process
+stream_watchdog = StreamWatchdog()
@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+from settings import SettingsFactory
+from stream_watchdog import stream_watchdog
+from supervisor import RemoteRedditHandler, SubredditWorker, share_rate_limit
+
+# the subreddits file is checked for changes this often
+subreddits_file_check_secs = 10
+
+
+def read_subreddits_file(path, default_subreddit_names):
+    # seeded from SUBREDDITS the first time, after which the file is the list of subreddits to run
+    if not os.path.exists(path):
+        print(f"Creating {path} from SUBREDDITS")
+        write_subreddits_file(path, {subreddit_name: dict() for subreddit_name in default_subreddit_names})
+    return load_subreddits_file(path)
+
+
+def load_subreddits_file(path):
+    # {"SubredditName": {"setting": value, ...}, ...}, settings override the subreddit's settings class
+    with open(path) as file:
+        subreddits = json.load(file)
+    if not isinstance(subreddits, dict):
+        raise ValueError(f"{path} should map subreddit names to their settings")
+    for subreddit_name, overrides in subreddits.items():
+        SettingsFactory.validate_overrides(subreddit_name, overrides)
+    return subreddits
+
+
+def write_subreddits_file(path, subreddits):
+    # replaced in one go, so the watcher never reads a half written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(subreddits, file, indent=2)
+    os.replace(temp_path, path)
+
+
+class ManagedSubreddit:
+    def __init__(self, subreddit_name, overrides, reddit_handler, worker=None):
+        self.subreddit_name = subreddit_name
+        self.overrides = overrides
+        # a RemoteRedditHandler in supervisor mode
+        self.reddit_handler = reddit_handler
+        self.worker = worker
+
+
+class SubredditManager:
+    # adds, removes and reconfigures subreddits whilst the bot keeps running, from discord admin commands or the
+    # subreddits file. Only the subreddit being changed is touched, other subreddits' streams carry on
+    def __init__(self, discord_client, credentials, subreddits_path, local_store=None, action_queue=None,
+                 stream_routes=None, worker_args=None):
+        self.discord_client = discord_client
+        # bot_password, bot_username, client_id, client_secret
+        self.credentials = credentials
+        self.subreddits_path = subreddits_path
+        self.local_store = local_store
+        self.action_queue = action_queue
+        # shared with the multiplexed stream, which only ever loses subreddits. Subreddits added whilst running
+        # get their own stream, the combined stream keeps the subreddits it started with until it's restarted
+        self.stream_routes = stream_routes
+        # local_store_path, action_workers, action_queue_size, reddit_pool_size, in supervisor mode
+        self.worker_args = worker_args
+        # held for the whole of each change, so changes never overlap
+        self.lock = threading.RLock()
+        self.subreddits = dict()
+        self.file_mtime = None
+
+    def adopt(self, subreddit_name, reddit_handler, worker=None):
+        # a subreddit started with the bot
+        with self.lock:
+            overrides = SettingsFactory.overrides.get(subreddit_name.lower(), dict())
+            self.subreddits[subreddit_name.lower()] = ManagedSubreddit(subreddit_name, overrides, reddit_handler,
+                                                                       worker)
+
+    def add(self, subreddit_name, overrides, save=True):
+        # bot imports this module, starting a subreddit only needs it once the bot is running
+        import bot
+
+        with self.lock:
+            if subreddit_name.lower() in self.subreddits:
+                raise ValueError(f"r/{subreddit_name} is already running")
+            SettingsFactory.set_overrides(subreddit_name, overrides)
+            print(f"Adding subreddit {subreddit_name}")
+            worker = None
+            try:
+                if self.worker_args:
+                    worker = SubredditWorker(self.discord_client, subreddit_name, self.credentials, *self.worker_args)
+                    self.discord_client.subreddit_workers.append(worker)
+                    share_rate_limit(self.discord_client.subreddit_workers)
+                    worker.start()
+                    reddit_handler = RemoteRedditHandler(self.discord_client, worker)
+                else:
+                    _, reddit_handler, _ = bot.bootstrap_subreddit(*self.credentials, self.discord_client,
+                                                                   self.local_store, self.action_queue, False,
+                                                                   subreddit_name)
+            except Exception:
+                SettingsFactory.remove_overrides(subreddit_name)
+                self.stop_streams(subreddit_name)
+                raise
+            self.subreddits[subreddit_name.lower()] = ManagedSubreddit(subreddit_name, dict(overrides),
+                                                                       reddit_handler, worker)
+            guild_message = self.map_guild(subreddit_name, reddit_handler)
+            if save:
+                self.save(subreddit_name, overrides)
+            return f"Added r/{subreddit_name}{guild_message}"
+
+    def remove(self, subreddit_name, save=True):
+        with self.lock:
+            managed = self.get(subreddit_name)
+            print(f"Removing subreddit {managed.subreddit_name}")
+            self.discord_client.remove_usernote_guild(managed.reddit_handler)
+            if managed.worker:
+                managed.worker.stop()
+                self.discord_client.subreddit_workers.remove(managed.worker)
+                if self.discord_client.subreddit_workers:
+                    share_rate_limit(self.discord_client.subreddit_workers)
+            else:
+                if self.stream_routes is not None:
+                    self.stream_routes.pop(managed.subreddit_name.lower(), None)
+                self.stop_streams(managed.subreddit_name)
+                # queued mod commands are left pending, and resumed if the subreddit is added again
+                managed.reddit_handler.close()
+            del self.subreddits[managed.subreddit_name.lower()]
+            SettingsFactory.remove_overrides(managed.subreddit_name)
+            if save:
+                self.save(managed.subreddit_name, None)
+            return f"Removed r/{managed.subreddit_name}"
+
+    def configure(self, subreddit_name, overrides, save=True):
+        # applied to the running subreddit, its streams aren't restarted
+        with self.lock:
+            managed = self.get(subreddit_name)
+            SettingsFactory.set_overrides(managed.subreddit_name, overrides)
+            if managed.worker:
+                managed.worker.configure(overrides)
+            else:
+                managed.reddit_handler.apply_settings(SettingsFactory.get_settings(managed.subreddit_name))
+            managed.overrides = dict(overrides)
+            self.discord_client.remove_usernote_guild(managed.reddit_handler)
+            guild_message = self.map_guild(managed.subreddit_name, managed.reddit_handler)
+            if save:
+                self.save(managed.subreddit_name, overrides)
+            return f"Reconfigured r/{managed.subreddit_name}{guild_message}"
+
+    def set_setting(self, subreddit_name, setting, raw_value):
+        # no value goes back to the subreddit's default
+        with self.lock:
+            overrides = dict(self.get(subreddit_name).overrides)
+            if raw_value is None:
+                overrides.pop(setting, None)
+            else:
+                try:
+                    overrides[setting] = json.loads(raw_value)
+                except ValueError:
+                    # plain text, e.g. a guild name
+                    overrides[setting] = raw_value
+            return self.configure(subreddit_name, overrides)
+
+    def describe(self):
+        lines = list()
+        with self.lock:
+            for managed in self.subreddits.values():
+                guild_name = SettingsFactory.get_settings(managed.subreddit_name).guild_name
+                overrides = f", settings {json.dumps(managed.overrides)}" if managed.overrides else ""
+                lines.append(f"r/{managed.subreddit_name}: discord server {guild_name}{overrides}")
+        return "\n".join(lines) or "No subreddits running"
+
+    def get(self, subreddit_name):
+        managed = self.subreddits.get(subreddit_name.lower())
+        if not managed:
+            raise ValueError(f"r/{subreddit_name} isn't running")
+        return managed
+
+    def map_guild(self, subreddit_name, reddit_handler):
+        settings = SettingsFactory.get_settings(subreddit_name)
+        if not settings.guild_name:
+            return ", it has no discord server for usernote commands"
+        if not self.discord_client.add_usernote_guild(settings.guild_name, reddit_handler):
+            return f", but I'm not in its discord server {settings.guild_name}"
+        return f", usernote commands are in {settings.guild_name}"
+
+    @staticmethod
+    def stop_streams(subreddit_name):
+        stream_watchdog.stop(f"{subreddit_name}-Usernotes")
+        stream_watchdog.stop(f"{subreddit_name}-Modlog")
+
+    def save(self, subreddit_name, overrides):
+        # only the changed subreddit's entry, so other edits to the file are kept. None removes it
+        if not self.subreddits_path:
+            return
+        subreddits = load_subreddits_file(self.subreddits_path)
+        for name in [name for name in subreddits if name.lower() == subreddit_name.lower()]:
+            del subreddits[name]
+        if overrides is not None:
+            subreddits[subreddit_name] = overrides
+        write_subreddits_file(self.subreddits_path, subreddits)
+        # already applied
+        self.file_mtime = os.stat(self.subreddits_path).st_mtime
+
+    def apply(self, subreddits):
+        # brings the running subreddits in line with the subreddits file, one failing doesn't stop the rest
+        desired = {subreddit_name.lower(): (subreddit_name, overrides)
+                   for subreddit_name, overrides in subreddits.items()}
+        with self.lock:
+            changes = [(self.remove, (managed.subreddit_name,)) for name, managed in self.subreddits.items()
+                       if name not in desired]
+            for name, (subreddit_name, overrides) in desired.items():
+                if name not in self.subreddits:
+                    changes.append((self.add, (subreddit_name, overrides)))
+                elif self.subreddits[name].overrides != overrides:
+                    changes.append((self.configure, (subreddit_name, overrides)))
+            for change, args in changes:
+                try:
+                    print(change(*args, save=False))
+                except Exception as e:
+                    message = f"Exception applying {self.subreddits_path} to r/{args[0]}: {e}\n" \
+                              f"```{traceback.format_exc()}```"
+                    self.discord_client.send_error_msg(message)
+                    print(message)
+
+    def start_watching(self):
+        self.file_mtime = os.stat(self.subreddits_path).st_mtime
+        threading.Thread(target=self.watch, daemon=True, name="SubredditsWatcher").start()
+
+    def watch(self):
+        while True:
+            time.sleep(subreddits_file_check_secs)
+            try:
+                file_mtime = os.stat(self.subreddits_path).st_mtime
+                if file_mtime == self.file_mtime:
+                    continue
+                # an invalid file isn't retried until it's edited again
+                self.file_mtime = file_mtime
+                print(f"{self.subreddits_path} changed, applying it")
+                self.apply(load_subreddits_file(self.subreddits_path))
+            except Exception as e:
+                message = f"Exception reading {self.subreddits_path}: {e}\n```{traceback.format_exc()}```"
+                self.discord_client.send_error_msg(message)
+                print(message)
@@ -0,0 +1,132 @@
+import threading
+import time
+import traceback
+
+from settings import Settings
+
+summary_header = "I have performed the following:\n\n"
+summary_separator = "\n\n---\n\n"
+# due digests are checked this often, so they may go out this much later than the interval
+digest_check_interval_secs = 30
+# reddit rejects longer private messages
+max_message_length = 10000
+truncated_notice = "\n\n...(truncated)"
+# a mod's digest is dropped after failing this many checks in a row, e.g. if they don't accept PMs
+max_send_attempts = 5
+# how long close waits for buffered summaries to be sent, what's left is sent on the next start
+close_timeout_secs = 20
+
+
+class SummaryDigest:
+    # "Bot Action Summary" PMs buffered per mod, sent as one PM once the oldest has waited the interval or enough
+    # have built up. Kept in the local store, so summaries buffered before a restart are still sent
+    def __init__(self, reddit_handler, local_store, interval_secs, max_actions):
+        self.reddit_handler = reddit_handler
+        self.local_store = local_store
+        self.subreddit_name = reddit_handler.subreddit_name.lower()
+        self.interval_secs = interval_secs
+        self.max_actions = max_actions
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        # mod name -> checks their digest has failed in a row
+        self.failed_sends = dict()
+        local_store.create_table("summary_digest (subreddit TEXT, mod TEXT, summary TEXT, created_utc REAL)")
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name=f"{reddit_handler.subreddit_name}-SummaryDigest")
+        self.thread.start()
+
+    def add(self, mod_name, summary):
+        self.local_store.execute("INSERT INTO summary_digest VALUES (?, ?, ?, ?)",
+                                 (self.subreddit_name, mod_name, summary, time.time()))
+        with self.condition:
+            self.condition.notify()
+
+    def stop(self):
+        # sends everything buffered, e.g. when digests are turned off or the subreddit is removed
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify()
+
+    def close(self):
+        # as stop, but waits for the sends, e.g. before a supervised worker process exits
+        self.stop()
+        self.thread.join(close_timeout_secs)
+
+    def run(self):
+        is_stopped = False
+        while not is_stopped:
+            with self.condition:
+                if not self.stop_event.is_set():
+                    self.condition.wait(digest_check_interval_secs)
+            # read before sending, so stopping during a send is still followed by sending everything
+            is_stopped = self.stop_event.is_set()
+            try:
+                self.send_due(send_all=is_stopped)
+            except Exception as e:
+                message = f"Exception sending {self.subreddit_name} summary digests: {e}\n" \
+                          f"```{traceback.format_exc()}```"
+                self.reddit_handler.discord_client.send_error_msg(message)
+                print(message)
+
+    def send_due(self, send_all=False):
+        if Settings.is_dry_run:
+            # kept until dry run is turned off, nothing would be sent
+            return
+        rows = self.local_store.query("SELECT rowid, mod, summary, created_utc FROM summary_digest "
+                                      "WHERE subreddit = ? ORDER BY created_utc", (self.subreddit_name,))
+        rows_by_mod = dict()
+        for row in rows:
+            rows_by_mod.setdefault(row[1], list()).append(row)
+        for mod_name, mod_rows in rows_by_mod.items():
+            if send_all or len(mod_rows) >= self.max_actions or time.time() - mod_rows[0][3] >= self.interval_secs:
+                # one mod's failing digest doesn't hold up the others'
+                try:
+                    self.send(mod_name, mod_rows)
+                    self.failed_sends.pop(mod_name, None)
+                except Exception as e:
+                    self.handle_failed_send(mod_name, mod_rows, e)
+
+    def handle_failed_send(self, mod_name, rows, e):
+        attempts = self.failed_sends.get(mod_name, 0) + 1
+        message = f"Exception sending {self.subreddit_name} summary digest to {mod_name} " \
+                  f"(attempt {attempts}/{max_send_attempts}): {e}\n```{traceback.format_exc()}```"
+        if attempts >= max_send_attempts:
+            # parts already sent were deleted as they went
+            self.delete(rows)
+            self.failed_sends.pop(mod_name, None)
+            message = f"Dropped {mod_name}'s unsent summaries. {message}"
+        else:
+            self.failed_sends[mod_name] = attempts
+        self.reddit_handler.discord_client.send_error_msg(message)
+        print(message)
+
+    def send(self, mod_name, rows):
+        # split rather than truncated, if a mod's summaries don't fit in one message
+        message_rows = list()
+        for row in rows:
+            if message_rows and len(self.format_digest(message_rows + [row])) > max_message_length:
+                self.send_message(mod_name, message_rows)
+                message_rows = list()
+            message_rows.append(row)
+        self.send_message(mod_name, message_rows)
+
+    def send_message(self, mod_name, rows):
+        print(f"Sending {self.subreddit_name} summary digest of {len(rows)} actions to {mod_name}")
+        digest = self.format_digest(rows)
+        # a single summary can be too long on its own
+        if len(digest) > max_message_length:
+            digest = digest[:max_message_length - len(truncated_notice)] + truncated_notice
+        self.reddit_handler.send_message(self.reddit_handler.reddit.redditor(mod_name), "Bot Action Summary", digest)
+        # only once sent, a failed send is retried on the next check
+        self.delete(rows)
+
+    def delete(self, rows):
+        self.local_store.execute(f"DELETE FROM summary_digest WHERE rowid IN ({','.join('?' * len(rows))})",
+                                 [row[0] for row in rows])
+
+    @staticmethod
+    def format_digest(rows):
+        if len(rows) == 1:
+            return summary_header + rows[0][2]
+        return f"I have performed the following {len(rows)} actions:\n\n" + \
+            summary_separator.join(row[2] for row in rows)
@@ -0,0 +1,263 @@
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from action_queue import ActionQueue
+from local_store import LocalStore
+from metrics import metrics
+from rate_limiter import reddit_rate_limiter
+from reddit_factory import reddit_client_factory
+from settings import Settings, SettingsFactory
+
+worker_restart_delay_secs = 30
+remote_call_timeout_secs = 300
+# checking every usernoted account is one reddit call each
+compaction_timeout_secs = 2 * 60 * 60
+remote_call_workers = 4
+# a removed subreddit's worker writes what it has buffered before exiting
+worker_stop_timeout_secs = 90
+
+
+class WorkerDiscordClient:
+    # stands in for the DiscordClient inside a worker process, errors go to the parent's discord over the pipe
+    def __init__(self, connection):
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.action_queue = None
+
+    def send(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def send_error_msg(self, message):
+        self.send(("error", message))
+
+
+def share_rate_limit(workers):
+    # each worker process paces its own calls, but they all spend the one account's rate limit
+    for worker in workers:
+        worker.set_rate_share(1 / len(workers))
+
+
+def run_subreddit_worker(connection, subreddit_name, credentials, local_store_path, action_workers,
+                         action_queue_size, reddit_pool_size, is_dry_run, settings_overrides, rate_share):
+    # bot imports this module for supervisor mode, the worker only needs it once the process has started
+    import bot
+
+    Settings.is_dry_run = is_dry_run
+    reddit_rate_limiter.set_share(rate_share)
+    SettingsFactory.set_overrides(subreddit_name, settings_overrides)
+    reddit_client_factory.configure(reddit_pool_size)
+    discord_client = WorkerDiscordClient(connection)
+    try:
+        local_store = LocalStore(local_store_path)
+        action_queue = ActionQueue(discord_client, action_workers, action_queue_size)
+        action_queue.start()
+        discord_client.action_queue = action_queue
+        bot_password, bot_username, client_id, client_secret = credentials
+        _, reddit_handler = bot.create_usernotes_thread(bot_password, bot_username, client_id, client_secret,
+                                                        discord_client, local_store, action_queue, subreddit_name)
+    except Exception as e:
+        message = f"Exception starting worker process for {subreddit_name}: {e}\n```{traceback.format_exc()}```"
+        discord_client.send_error_msg(message)
+        print(message)
+        os._exit(1)
+    discord_client.send(("ready", None))
+
+    # discord commands for this subreddit, each answered with ("result", request_id, succeeded, value)
+    executor = ThreadPoolExecutor(max_workers=remote_call_workers, thread_name_prefix="RemoteCall")
+    while True:
+        try:
+            kind, request_id, name, args = connection.recv()
+        except EOFError:
+            # the supervisor has gone, stream threads aren't daemons so exit outright
+            print(f"Supervisor for {subreddit_name} has gone, exiting worker")
+            os._exit(0)
+        if kind == "set_dry_run":
+            Settings.is_dry_run = args[0]
+        elif kind == "rate_share":
+            reddit_rate_limiter.set_share(args[0])
+        elif kind == "configure":
+            SettingsFactory.set_overrides(subreddit_name, args[0])
+            reddit_handler.apply_settings(SettingsFactory.get_settings(subreddit_name))
+        elif kind == "stop":
+            print(f"Stopping worker for {subreddit_name}")
+            reddit_handler.close()
+            os._exit(0)
+        elif kind == "call":
+            executor.submit(serve_remote_call, discord_client, reddit_handler, request_id, name, args)
+
+
+def serve_remote_call(discord_client, reddit_handler, request_id, name, args):
+    try:
+        result = getattr(reddit_handler, name)(*args)
+        discord_client.send(("result", request_id, True, result))
+    except Exception as e:
+        # reddit exceptions don't always pickle, so only the message goes back
+        discord_client.send(("result", request_id, False, f"{e}\n```{traceback.format_exc()}```"))
+
+
+class SubredditWorker:
+    # one subreddit's streams and mod command execution in its own process, restarted if it dies
+    def __init__(self, discord_client, subreddit_name, credentials, local_store_path, action_workers,
+                 action_queue_size, reddit_pool_size):
+        self.discord_client = discord_client
+        self.subreddit_name = subreddit_name
+        self.worker_args = (credentials, local_store_path, action_workers, action_queue_size, reddit_pool_size)
+        self.settings_overrides = SettingsFactory.overrides.get(subreddit_name.lower(), dict())
+        # set by share_rate_limit before the worker starts
+        self.rate_share = 1
+        # a fresh interpreter, forking would copy the discord client's threads and event loop
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.process = None
+        self.connection = None
+        self.spawn_time = None
+        self.pending_calls = dict()
+        self.next_request_id = 0
+        self.is_stopped = False
+
+    def start(self):
+        threading.Thread(target=self.supervise, daemon=True, name=f"{self.subreddit_name}-Supervisor").start()
+
+    def supervise(self):
+        while not self.is_stopped:
+            start_time = time.time()
+            self.spawn()
+            self.read_until_exit()
+            exit_code = self.process.exitcode
+            with self.lock:
+                self.connection = None
+                pending_calls = self.pending_calls
+                self.pending_calls = dict()
+            for future in pending_calls.values():
+                future.set_exception(RuntimeError(f"Worker process for {self.subreddit_name} exited"))
+            if self.is_stopped:
+                print(f"Worker process for {self.subreddit_name} stopped")
+                return
+            metrics.increment("usernotebot_worker_restarts_total", subreddit=self.subreddit_name)
+            message = f"Worker process for {self.subreddit_name} exited with code {exit_code} after " \
+                      f"{time.time() - start_time:.0f}s, restarting in {worker_restart_delay_secs} seconds"
+            self.discord_client.send_error_msg(message)
+            print(message)
+            time.sleep(worker_restart_delay_secs)
+
+    def spawn(self):
+        parent_connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=run_subreddit_worker, name=f"{self.subreddit_name}-Worker",
+                                       args=(child_connection, self.subreddit_name, *self.worker_args,
+                                             Settings.is_dry_run, self.settings_overrides, self.rate_share),
+                                       daemon=True)
+        process.start()
+        # only the worker holds the other end, so reads fail once it exits
+        child_connection.close()
+        with self.lock:
+            self.process = process
+            self.connection = parent_connection
+            self.spawn_time = time.time()
+        print(f"Started worker process {process.pid} for {self.subreddit_name}")
+
+    def read_until_exit(self):
+        while True:
+            try:
+                kind, *payload = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "error":
+                self.discord_client.send_error_msg(payload[0])
+            elif kind == "ready":
+                ready_secs = time.time() - self.spawn_time
+                metrics.set_gauge("usernotebot_startup_seconds", ready_secs, phase=f"worker {self.subreddit_name}")
+                print(f"Worker process for {self.subreddit_name} is ready after {ready_secs:.1f}s")
+            elif kind == "result":
+                request_id, succeeded, value = payload
+                with self.lock:
+                    future = self.pending_calls.pop(request_id, None)
+                if not future:
+                    continue
+                if succeeded:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(f"Worker for {self.subreddit_name} failed: {value}"))
+        self.process.join()
+
+    def call(self, name, *args, timeout=remote_call_timeout_secs):
+        # blocks like a local RedditActionsHandler call, discord runs these in its reddit executor
+        future = Future()
+        with self.lock:
+            if not self.connection:
+                raise RuntimeError(f"Worker process for {self.subreddit_name} is restarting, try again shortly")
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            self.pending_calls[request_id] = future
+            self.connection.send(("call", request_id, name, args))
+        return future.result(timeout=timeout)
+
+    def set_dry_run(self, is_dry_run):
+        with self.lock:
+            if self.connection:
+                self.connection.send(("set_dry_run", None, None, (is_dry_run,)))
+
+    def set_rate_share(self, rate_share):
+        # also used if the worker is restarted
+        with self.lock:
+            self.rate_share = rate_share
+            if self.connection:
+                self.connection.send(("rate_share", None, None, (rate_share,)))
+
+    def configure(self, settings_overrides):
+        # also used if the worker is restarted
+        with self.lock:
+            self.settings_overrides = settings_overrides
+            if self.connection:
+                self.connection.send(("configure", None, None, (settings_overrides,)))
+
+    def stop(self):
+        # the subreddit was removed, the worker isn't restarted
+        with self.lock:
+            self.is_stopped = True
+            process = self.process
+            if self.connection:
+                self.connection.send(("stop", None, None, ()))
+        if process:
+            process.join(worker_stop_timeout_secs)
+            if process.is_alive():
+                print(f"Worker process for {self.subreddit_name} didn't stop, terminating it")
+                process.terminate()
+
+
+class RemoteRedditHandler:
+    # the parts of RedditActionsHandler discord commands use, served by the subreddit's worker process
+    def __init__(self, discord_client, worker):
+        self.discord_client = discord_client
+        self.worker = worker
+        self.subreddit_name = worker.subreddit_name
+
+    def get_mod_permissions(self, mod):
+        return self.worker.call("get_mod_permissions", mod)
+
+    def redditor_exists(self, username):
+        return self.worker.call("redditor_exists", username)
+
+    def get_usernotes(self, username):
+        return self.worker.call("get_usernotes", username)
+
+    def get_recent_removals(self, mod, count):
+        return self.worker.call("get_recent_removals", mod, count)
+
+    def refresh_rules(self):
+        return self.worker.call("refresh_rules")
+
+    def find_ban_type(self, target_user, ban_command):
+        return self.worker.call("find_ban_type", target_user, ban_command)
+
+    def compact_usernotes(self, archive_age_days, check_accounts):
+        return self.worker.call("compact_usernotes", archive_age_days, check_accounts, timeout=compaction_timeout_secs)
+
+    def take_usernote_actions(self, mod, url, target_user, full_note, rules_str, content_fullname, is_comment,
+                              should_comment, cited_rules, ban_type):
+        return self.worker.call("take_usernote_actions", mod, url, target_user, full_note, rules_str,
+                                content_fullname, is_comment, should_comment, cited_rules, ban_type)
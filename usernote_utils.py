@@ -28,25 +28,22 @@ def find_rules(rules):
 # attempts to find ban type from input: num, i, p
 # if input is a ban request and matches the supported ban types, returns the type (number or perm)
 # otherwise returns empty string (not ban)
-def find_ban(discord_client, subreddit, user, ban_type):
+def find_ban(discord_client, subreddit, user, ban_type, ban_history=None):
     if not ban_type:
         return None
     if ban_type.isnumeric():
         return ban_type
     # incremental ban
     elif ban_type == "i":
+        # local ban history first, only walk the user's mod notes on a miss
+        ban_details = ban_history.last_ban_details(user) if ban_history else None
+        if ban_details:
+            return double_ban(discord_client, user, ban_type, "ban history", ban_details)
         for log in subreddit.mod.notes.redditors(user):
             if log.action == "banuser" and len(log.details) > 0:
-                try:
-                    # hopefully ban detail is always in (# days) ...
-                    banned_days = int(log.details.split(" ")[0])
-                    return str(banned_days * 2)
-                except Exception as e:
-                    error_formatted = traceback.format_exc()
-                    print(error_formatted)
-                    discord_client.send_error_msg(f"Caught exception in finding user ban:\n{error_formatted} "
-                                                  f"when processing {user}: {ban_type} with {log} {log.details}")
-                    return "3"
+                if ban_history:
+                    ban_history.record_ban(user, log.details, log.created_at)
+                return double_ban(discord_client, user, ban_type, log, log.details)
         # if no notes, default to 3 days
         return "3"
     elif ban_type == "p":
@@ -54,6 +51,20 @@ def find_ban(discord_client, subreddit, user, ban_type):
     return None
 
 
+# doubles the last ban, or 3 days if it wasn't in days (e.g. permanent)
+def double_ban(discord_client, user, ban_type, source, ban_details):
+    try:
+        # hopefully ban detail is always in (# days) ...
+        banned_days = int(ban_details.split(" ")[0])
+        return str(banned_days * 2)
+    except Exception as e:
+        error_formatted = traceback.format_exc()
+        print(error_formatted)
+        discord_client.send_error_msg(f"Caught exception in finding user ban:\n{error_formatted} "
+                                      f"when processing {user}: {ban_type} with {source} {ban_details}")
+        return "3"
+
+
 def find_message(command):
     if not command:
         return ""
@@ -0,0 +1,149 @@
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from pmtw.constants import MAX_WIKI_SIZE, USERNOTES_PAGE
+from prawcore import Conflict
+
+from settings import Settings
+
+coalesce_window_secs = 3
+# saves rejected because someone else edited the page first, each is reloaded and tried again
+max_conflict_attempts = 3
+# revisions searched for our own save, to find its revision id
+own_revision_search_limit = 10
+# how long close waits for buffered notes to be written
+close_timeout_secs = 60
+
+
+class UsernoteWriteBuffer:
+    # every toolbox usernotes write is a full read-decompress-modify-compress-write of the wiki page,
+    # so notes arriving close together are committed in a single wiki revision
+    def __init__(self, reddit_handler, window_secs=coalesce_window_secs):
+        self.reddit_handler = reddit_handler
+        self.window_secs = window_secs
+        self.condition = threading.Condition()
+        self.pending = list()
+        # held from load to save, usernotes compaction holds it too so neither overwrites the other
+        self.commit_lock = threading.Lock()
+        self.is_closed = False
+        # makes each save's reason unique, so its revision can be found
+        self.write_ids = itertools.count(int(time.time()))
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name=f"{reddit_handler.subreddit.display_name}-UsernoteWriter")
+        self.thread.start()
+
+    def add(self, note):
+        # returned future resolves once the note is durably written to the wiki
+        future = Future()
+        if Settings.is_dry_run:
+            print("\tDRY RUN!!!")
+            future.set_result(None)
+            return future
+        with self.condition:
+            if self.is_closed:
+                future.set_exception(RuntimeError(f"r/{self.reddit_handler.subreddit.display_name} was removed, "
+                                                  f"usernote for {note.user} not written"))
+                return future
+            self.pending.append((note, future))
+            self.condition.notify()
+        return future
+
+    def close(self):
+        # writes what's pending, then stops
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+        self.thread.join(close_timeout_secs)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.is_closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+            # let other notes arrive before committing
+            time.sleep(self.window_secs)
+            with self.condition:
+                batch = self.pending
+                self.pending = list()
+            self.flush(batch)
+
+    def flush(self, batch):
+        subreddit_name = self.reddit_handler.subreddit.display_name
+        print(f"Writing {len(batch)} usernotes to {subreddit_name} in one wiki revision")
+        try:
+            self.commit([note for note, _ in batch])
+        except Exception as e:
+            message = f"Exception writing {len(batch)} usernotes for {subreddit_name}: {e}\n" \
+                      f"```{traceback.format_exc()}```"
+            self.reddit_handler.discord_client.send_error_msg(message)
+            print(message)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for note, future in batch:
+            future.set_result(note)
+
+    def commit(self, notes):
+        with self.commit_lock:
+            return self.commit_notes(notes)
+
+    def commit_notes(self, notes):
+        # the save is only accepted if the page is still at the revision we loaded, so another editor's notes
+        # (toolbox, other bots) are never overwritten. On a conflict the page is reloaded and the notes applied
+        # again, skipping any already on it, e.g. from a save that reached reddit but whose response was lost
+        usernotes = self.reddit_handler.toolbox.usernotes
+        usernotes_index = self.reddit_handler.usernotes_index
+        for attempt in range(1, max_conflict_attempts + 1):
+            # read before loading, an edit in between only makes the save conflict
+            loaded_revision_id = usernotes_index.latest_revision_id(wait=True)
+            self.reddit_handler.reddit_read(usernotes.load, wait=True)
+            new_notes = [note for note in notes if not self.find_written(usernotes, note)]
+            if not new_notes:
+                # the revision holding them is unknown, so the index reloads rather than assume one
+                usernotes_index.invalidate()
+                return
+            for note in new_notes:
+                usernotes.add(note, lazy=True)
+            reason = f"create {len(new_notes)} new notes via usernotebot {next(self.write_ids)}"
+            try:
+                # only the save is retried, retrying the load and add could write the notes twice
+                self.reddit_handler.reddit_call(lambda: self.save(usernotes, reason, loaded_revision_id),
+                                                "usernote")
+            except Conflict:
+                print(f"Usernotes for {self.reddit_handler.subreddit.display_name} were edited whilst writing, "
+                      f"reloading (attempt {attempt}/{max_conflict_attempts})")
+                continue
+            usernotes_index.add_written(notes, loaded_revision_id, self.find_own_revision_id(reason))
+            return
+        raise RuntimeError(f"Usernotes for {self.reddit_handler.subreddit.display_name} kept being edited "
+                           f"whilst writing, {len(notes)} notes not written")
+
+    def save(self, usernotes, reason, previous_revision_id):
+        # as pmtw's save, which can't make the edit conditional. pmtw~=1.1 has no public way to encode the page
+        content = usernotes._ToolboxUsernotes__compress_json()
+        if len(content) > MAX_WIKI_SIZE:
+            raise OverflowError(f"Usernote data {len(content) - MAX_WIKI_SIZE} bytes too big to insert")
+        self.reddit_handler.subreddit.wiki[USERNOTES_PAGE].edit(content=content, reason=reason,
+                                                                previous=previous_revision_id)
+
+    def find_own_revision_id(self, reason):
+        # reddit's wiki edit doesn't return the new revision, it's found by its reason, which is unique to this save
+        revisions = self.reddit_handler.reddit_read(
+            lambda: list(self.reddit_handler.subreddit.wiki[USERNOTES_PAGE].revisions(limit=own_revision_search_limit)),
+            wait=True)
+        for revision in revisions:
+            if revision["reason"] == reason:
+                return revision["id"]
+        return None
+
+    @staticmethod
+    def find_written(usernotes, note):
+        for written_note in usernotes.list_notes(note.user):
+            if written_note.time == note.time and written_note.note == note.note:
+                return written_note
+        return None
@@ -0,0 +1,250 @@
+import argparse
+import base64
+import json
+import os
+import time
+import zlib
+from collections import namedtuple
+
+from pmtw.constants import MAX_WIKI_SIZE, USERNOTES_PAGE, USERNOTES_VERSION
+from prawcore import Conflict, NotFound
+
+from metrics import metrics
+from settings import Settings
+
+archive_page = "usernotes_archive"
+# decode time is the fastest of several runs, so one slow run doesn't skew the before/after comparison
+decode_timing_runs = 5
+account_check_progress_interval = 100
+edited_during_compaction = "Usernotes page was edited during compaction, it was left unchanged. Try again"
+
+# plain values, so it can be sent from a supervised worker process
+CompactionReport = namedtuple("CompactionReport", [
+    "users_before", "notes_before", "page_bytes_before", "decode_secs_before",
+    "users_after", "notes_after", "page_bytes_after", "decode_secs_after",
+    "closed_accounts", "archived_notes", "archive_age_days", "saved"])
+
+
+def decode_blob(blob):
+    if not blob:
+        return dict()
+    return json.loads(zlib.decompress(base64.b64decode(blob)).decode("utf-8"))
+
+
+def encode_blob(users):
+    # as toolbox and pmtw encode it
+    return base64.b64encode(zlib.compress(json.dumps(users).encode("utf-8"), 9)).decode("utf-8")
+
+
+def time_decode(blob):
+    fastest_secs = None
+    for _ in range(decode_timing_runs):
+        start_time = time.perf_counter()
+        decode_blob(blob)
+        elapsed_secs = time.perf_counter() - start_time
+        fastest_secs = elapsed_secs if fastest_secs is None else min(fastest_secs, elapsed_secs)
+    return fastest_secs
+
+
+def count_notes(users):
+    return sum(len(user["ns"]) for user in users.values())
+
+
+def get_index(values, value):
+    if value not in values:
+        values.append(value)
+    return values.index(value)
+
+
+def format_report(subreddit_name, report):
+    def page_size(page_bytes):
+        return f"{page_bytes / 1024:.1f}KB ({100 * page_bytes / MAX_WIKI_SIZE:.0f}% of the wiki page limit)"
+
+    outcome = "Compacted" if report.saved else "Would compact (nothing saved)"
+    return f"{outcome} r/{subreddit_name} usernotes, archiving notes older than {report.archive_age_days} days " \
+           f"and notes for {report.closed_accounts} deleted or suspended accounts to the {archive_page} page\n" \
+           f"Before: {report.users_before} users, {report.notes_before} notes, " \
+           f"{page_size(report.page_bytes_before)}, decoded in {report.decode_secs_before * 1000:.1f}ms\n" \
+           f"After: {report.users_after} users, {report.notes_after} notes, " \
+           f"{page_size(report.page_bytes_after)}, decoded in {report.decode_secs_after * 1000:.1f}ms\n" \
+           f"Archived {report.archived_notes} notes"
+
+
+class UsernotesCompactor:
+    # every usernote write reloads and re-encodes the whole toolbox usernotes page, so old notes and notes for
+    # closed accounts are moved to an archive page in the same format, where they're kept but no longer loaded
+    def __init__(self, reddit_handler):
+        self.reddit_handler = reddit_handler
+        self.reddit = reddit_handler.reddit
+        self.subreddit = reddit_handler.subreddit
+
+    def compact(self, archive_age_days, check_accounts=True):
+        cutoff_utc = time.time() - archive_age_days * 24 * 60 * 60
+        closed_accounts = set()
+        if check_accounts:
+            # checked before taking the write buffer's lock, as it can take a while. Users first noted after
+            # this load aren't checked, so are kept
+            _, _, users = self.load()
+            # users whose notes are all being archived anyway don't need their account checked
+            closed_accounts = self.find_closed_accounts([username for username, user in users.items()
+                                                         if any(note["t"] >= cutoff_utc for note in user["ns"])])
+
+        # holding the write buffer's lock, so this process writes no note between our load and save. Anything else,
+        # such as toolbox or the bot whilst this runs from the command line, is caught by the conditional save
+        with self.reddit_handler.usernote_writer.commit_lock:
+            page_content, revision_id, users = self.load()
+            page = json.loads(page_content)
+            decode_secs_before = time_decode(page["blob"])
+            kept_users = dict()
+            archived_users = dict()
+            for username, user in users.items():
+                is_closed = username in closed_accounts
+                kept_notes = [note for note in user["ns"] if not is_closed and note["t"] >= cutoff_utc]
+                archived_notes = [note for note in user["ns"] if is_closed or note["t"] < cutoff_utc]
+                if kept_notes:
+                    kept_users[username] = {"ns": kept_notes}
+                if archived_notes:
+                    archived_users[username] = {"ns": archived_notes}
+
+            page["blob"] = encode_blob(kept_users)
+            compacted_content = json.dumps(page)
+            report = CompactionReport(
+                len(users), count_notes(users), len(page_content.encode("utf-8")), decode_secs_before,
+                len(kept_users), count_notes(kept_users), len(compacted_content.encode("utf-8")),
+                time_decode(page["blob"]), len(closed_accounts), count_notes(archived_users), archive_age_days,
+                saved=bool(archived_users) and not Settings.is_dry_run)
+            if archived_users:
+                self.save(page["constants"], archived_users, compacted_content, revision_id, report)
+
+        self.record_metrics(report)
+        print(format_report(self.subreddit.display_name, report))
+        return report
+
+    def load(self):
+        wikipage = self.subreddit.wiki[USERNOTES_PAGE]
+        page_content = self.reddit_handler.reddit_read(lambda: wikipage.content_md)
+        page = json.loads(page_content)
+        if page["ver"] != USERNOTES_VERSION:
+            raise RuntimeError(f"Usernotes page is version {page['ver']}, expected {USERNOTES_VERSION}")
+        return page_content, wikipage.revision_id, decode_blob(page["blob"])
+
+    def find_closed_accounts(self, usernames):
+        print(f"Checking {len(usernames)} {self.subreddit.display_name} usernoted accounts")
+        closed_accounts = set()
+        for i, username in enumerate(usernames):
+            if self.is_closed_account(username):
+                closed_accounts.add(username)
+            if (i + 1) % account_check_progress_interval == 0:
+                print(f"Checked {i + 1}/{len(usernames)} accounts, {len(closed_accounts)} deleted or suspended")
+        return closed_accounts
+
+    def is_closed_account(self, username):
+        try:
+            # suspended accounts only have a name and is_suspended, deleted accounts aren't found
+            return self.reddit_handler.reddit_read(
+                lambda: getattr(self.reddit.redditor(username), "is_suspended", False), "maintenance")
+        except NotFound:
+            return True
+
+    def save(self, constants, archived_users, compacted_content, revision_id, report):
+        archive_content, is_new_archive = self.merge_archive(constants, archived_users)
+        if len(archive_content.encode("utf-8")) > MAX_WIKI_SIZE:
+            raise RuntimeError(f"The {archive_page} page would exceed reddit's wiki page limit, "
+                               f"nothing was saved. Archive fewer notes with a longer archive age")
+        # toolbox and other bots also edit the page, their edits would be lost. Checked up front to avoid writing
+        # the archive, the save itself is rejected if the page changes after this
+        if self.reddit_handler.usernotes_index.latest_revision_id() != revision_id:
+            raise RuntimeError(edited_during_compaction)
+
+        # the archive is saved first, so an interrupted compaction only ever duplicates notes.
+        # these hold up usernote writes, so go ahead of the account checks
+        archive_wikipage = self.subreddit.wiki[archive_page]
+        self.reddit_handler.reddit_call(
+            lambda: archive_wikipage.edit(content=archive_content,
+                                          reason=f"archive {report.archived_notes} usernotes"), "usernote")
+        if is_new_archive:
+            # mod only, like the usernotes page
+            self.reddit_handler.reddit_call(lambda: archive_wikipage.mod.update(listed=False, permlevel=2),
+                                            "usernote")
+        try:
+            self.reddit_handler.reddit_call(
+                lambda: self.subreddit.wiki[USERNOTES_PAGE].edit(content=compacted_content,
+                                                                 reason=f"archive {report.archived_notes} usernotes",
+                                                                 previous=revision_id),
+                "usernote")
+        except Conflict:
+            # the archived notes are also still on the usernotes page, the next compaction doesn't archive them twice
+            raise RuntimeError(edited_during_compaction)
+        # reload the index on the next query, rather than when the revision is next checked
+        self.reddit_handler.usernotes_index.last_revision_check = 0
+
+    def merge_archive(self, constants, archived_users):
+        try:
+            archive = json.loads(self.reddit_handler.reddit_read(lambda: self.subreddit.wiki[archive_page].content_md))
+            archive_users = decode_blob(archive["blob"])
+            is_new_archive = False
+        except NotFound:
+            archive = {"ver": USERNOTES_VERSION, "constants": {"users": [], "warnings": []}, "blob": ""}
+            archive_users = dict()
+            is_new_archive = True
+
+        # notes refer to mods and warnings by index, which differ between the two pages
+        archive_constants = archive["constants"]
+        for username, user in archived_users.items():
+            notes = archive_users.setdefault(username, {"ns": list()})["ns"]
+            for note in user["ns"]:
+                archived_note = dict(note)
+                archived_note["m"] = get_index(archive_constants["users"], constants["users"][note["m"]])
+                archived_note["w"] = get_index(archive_constants["warnings"], constants["warnings"][note["w"]])
+                # an interrupted compaction may have archived it already
+                if not any(n["t"] == note["t"] and n["n"] == note["n"] for n in notes):
+                    notes.append(archived_note)
+            notes.sort(key=lambda n: n["t"], reverse=True)
+        archive["blob"] = encode_blob(archive_users)
+        return json.dumps(archive), is_new_archive
+
+    def record_metrics(self, report):
+        page_bytes = report.page_bytes_after if report.saved else report.page_bytes_before
+        decode_secs = report.decode_secs_after if report.saved else report.decode_secs_before
+        metrics.set_gauge("usernotebot_usernotes_page_bytes", page_bytes, subreddit=self.subreddit.display_name)
+        metrics.set_gauge("usernotebot_usernotes_decode_seconds", decode_secs, subreddit=self.subreddit.display_name)
+
+
+class ConsoleErrors:
+    # stands in for discord when run from the command line, reddit_call already prints its errors
+    def send_error_msg(self, message):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old usernotes, and usernotes for deleted or suspended "
+                                                 f"accounts, from a subreddit's usernotes page to {archive_page}")
+    parser.add_argument("subreddit")
+    parser.add_argument("--archive-age-days", type=int,
+                        help="archive notes older than this, defaults to the subreddit's settings")
+    parser.add_argument("--skip-account-check", action="store_true",
+                        help="only archive by age, checking accounts takes one reddit call per usernoted user")
+    parser.add_argument("--dry-run", action="store_true", help="report the sizes without saving either page")
+    args = parser.parse_args()
+
+    # bot imports this module through reddit_actions_handler
+    import config
+    from bot import create_reddit
+    from local_store import LocalStore
+    from reddit_actions_handler import RedditActionsHandler
+
+    Settings.is_dry_run = args.dry_run
+    client_id = os.environ.get("CLIENT_ID", config.CLIENT_ID)
+    client_secret = os.environ.get("CLIENT_SECRET", config.CLIENT_SECRET)
+    bot_username = os.environ.get("BOT_USERNAME", config.BOT_USERNAME)
+    bot_password = os.environ.get("BOT_PASSWORD", config.BOT_PASSWORD)
+    local_store_path = os.environ.get("LOCAL_STORE_PATH", config.LOCAL_STORE_PATH)
+    reddit = create_reddit(bot_password, bot_username, client_id, client_secret, f"{args.subreddit}.compaction")
+    subreddit = reddit.subreddit(args.subreddit)
+    # compaction doesn't check moderators
+    reddit_handler = RedditActionsHandler(reddit, subreddit, ConsoleErrors(), LocalStore(local_store_path), None)
+    reddit_handler.compact_usernotes(args.archive_age_days, not args.skip_account_check)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from pmtw.constants import USERNOTES_PAGE
+from pmtw.usernotes import ToolboxUsernotes
+
+revision_check_interval_secs = 10
+
+
+class UsernotesIndex:
+    # decoded usernotes keyed by lower-cased username, only re-downloaded when the wiki revision changes
+    def __init__(self, reddit_handler):
+        self.reddit_handler = reddit_handler
+        self.subreddit = reddit_handler.subreddit
+        # own copy of the page, so reloads never interleave with the write buffer's load-add-save
+        self.usernotes = ToolboxUsernotes(self.subreddit, lazy=True)
+        self.lock = threading.Lock()
+        # one reload at a time, queries arriving during it wait for it rather than loading the page again
+        self.refresh_lock = threading.Lock()
+        self.notes_by_user = dict()
+        self.revision_id = None
+        self.last_revision_check = 0
+
+    def get_notes(self, username):
+        # newest first, empty if the user has no usernotes
+        self.refresh_if_changed()
+        with self.lock:
+            return list(self.notes_by_user.get(username.lower(), list()))
+
+    def refresh_if_changed(self):
+        with self.refresh_lock:
+            if time.time() - self.last_revision_check < revision_check_interval_secs:
+                return
+            revision_id = self.latest_revision_id()
+            self.last_revision_check = time.time()
+            with self.lock:
+                if revision_id == self.revision_id:
+                    return
+            print(f"Usernotes revision for {self.subreddit.display_name} changed to {revision_id}, reloading index")
+            self.reddit_handler.reddit_read(self.usernotes.load)
+            notes_by_user = dict()
+            for user in self.usernotes.list_users():
+                notes_by_user[user.lower()] = self.usernotes.list_notes(user, reverse=True)
+            with self.lock:
+                self.notes_by_user = notes_by_user
+                self.revision_id = revision_id
+
+    def latest_revision_id(self, wait=False):
+        revisions = self.reddit_handler.reddit_read(
+            lambda: list(self.subreddit.wiki[USERNOTES_PAGE].revisions(limit=1)), wait=wait)
+        return revisions[0]["id"] if revisions else None
+
+    def invalidate(self):
+        # reloaded on the next query
+        with self.lock:
+            self.revision_id = None
+            self.last_revision_check = 0
+
+    def add_written(self, notes, previous_revision_id, revision_id):
+        # called after our own save, from previous_revision_id to revision_id, so the index stays current without
+        # re-downloading the page
+        if revision_id is None:
+            self.invalidate()
+            return
+        with self.lock:
+            if self.revision_id == revision_id:
+                # already reloaded with our save
+                return
+            if self.revision_id is None or self.revision_id != previous_revision_id:
+                # never loaded, or missing edits made before ours, the next query reloads the page instead
+                self.last_revision_check = 0
+                return
+            for note in notes:
+                user_notes = self.notes_by_user.setdefault(note.user.lower(), list())
+                if not any(n.time == note.time and n.note == note.note for n in user_notes):
+                    user_notes.insert(0, note)
+            self.revision_id = revision_id